@@ -0,0 +1,290 @@
+"""
+均线偏离度的向量化计算引擎
+把各ETF的收盘价按自身交易序列排成 (序号 x ETF) 矩阵, 共用一次累加和计算所有周期的均线
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from qlib_workflow.data.feature_cube import FeatureCube
+
+
+MA_PERIODS = [5, 10, 20, 30, 60, 120, 200]
+
+
+def stack_by_instrument(codes, values):
+    """按ETF自身的交易顺序把长表数值排成 (序号 x ETF) 矩阵
+
+    Args:
+        codes: 每行的ETF代码, 行序即各ETF内部的时间顺序
+        values: 每行的数值
+
+    Returns:
+        matrix: (最长序列长度, ETF数) 矩阵, 不足处为NaN
+        rows, cols: 长表每行在矩阵中的位置, 用于取回结果
+    """
+    cols, uniques = pd.factorize(pd.Series(codes))
+
+    # 组内序号: 稳定排序后各行减去所在组的起始位置
+    order = np.argsort(cols, kind='stable')
+    starts = np.r_[0, np.flatnonzero(np.diff(cols[order])) + 1]
+    lengths = np.diff(np.r_[starts, len(cols)])
+    rows = np.empty(len(cols), dtype=np.int64)
+    rows[order] = np.arange(len(cols)) - np.repeat(starts, lengths)
+
+    matrix = np.full((rows.max() + 1 if len(rows) else 0, len(uniques)), np.nan)
+    matrix[rows, cols] = values
+    return matrix, rows, cols
+
+
+def rolling_means(matrix, periods=MA_PERIODS):
+    """沿第0轴计算多个周期的滚动均值, 与 rolling(window=p, min_periods=p).mean() 语义一致
+
+    所有周期共用一次累加和; 窗口内存在NaN时结果为NaN。
+    """
+    valid = ~np.isnan(matrix)
+    # 减去各列均值再累加, 减小累加和的量级以控制舍入误差
+    center = np.zeros(matrix.shape[1])
+    has_data = valid.any(axis=0)
+    center[has_data] = np.nanmean(matrix[:, has_data], axis=0)
+
+    n_rows = matrix.shape[0]
+    csum = np.zeros((n_rows + 1, matrix.shape[1]))
+    np.cumsum(np.where(valid, matrix - center, 0.0), axis=0, out=csum[1:])
+    count = np.zeros((n_rows + 1, matrix.shape[1]), dtype=np.int64)
+    np.cumsum(valid, axis=0, out=count[1:])
+
+    means = {}
+    for period in periods:
+        ma = np.full(matrix.shape, np.nan)
+        if period <= n_rows:
+            window_sum = csum[period:] - csum[:-period]
+            full = (count[period:] - count[:-period]) == period
+            ma[period - 1:] = np.where(full, window_sum / period + center, np.nan)
+        means[period] = ma
+    return means
+
+
+def calculate_ma_bias_columns(codes, close, periods=MA_PERIODS):
+    """计算长表每行各周期的均线偏离度 close / ma, 返回 {周期: 数组}"""
+    close = np.asarray(close, dtype=np.float64)
+    matrix, rows, cols = stack_by_instrument(codes, close)
+    means = rolling_means(matrix, periods)
+    return {period: close / ma[rows, cols] for period, ma in means.items()}
+
+
+def daily_cross_section_max(df, value_cols, code_col='ts_code', date_col='trade_date'):
+    """逐日截面最大值, 与按日期分组后 idxmax 的结果一致(并列时取代码排序靠前者)
+
+    Returns:
+        dates: 交易日
+        instruments: ETF代码, argmax编码即其下标
+        codes: (交易日 x 指标) 的argmax编码, 当日无有效值时为-1
+        values: (交易日 x 指标) 的最大值
+    """
+    cube = FeatureCube.from_frame(df, fields=value_cols, instrument_col=code_col,
+                                  date_col=date_col, dtype=np.float64)
+    if not len(cube.instruments):
+        n_dates = len(cube.dates)
+        return cube.dates, cube.instruments, np.full((n_dates, len(value_cols)), -1), \
+            np.full((n_dates, len(value_cols)), np.nan)
+
+    missing = np.isnan(cube.values)
+    codes = np.where(missing, -np.inf, cube.values).argmax(axis=0)
+    values = np.take_along_axis(cube.values, codes[np.newaxis], axis=0)[0]
+
+    empty = missing.all(axis=0)
+    codes[empty] = -1
+    return cube.dates, cube.instruments, codes, values
+
+
+class RollingMAState:
+    """各ETF最近 window 个收盘价及各周期的滚动和, 用于逐日增量计算均线偏离度
+
+    window按时间顺序保存最近的收盘价(最新在最后一列, 不足处为NaN);
+    sums/counts为各周期窗口内有效值的和与个数, 随新数据逐日滚动更新。
+    """
+
+    def __init__(self, codes, window, sums, counts, last_date, periods=MA_PERIODS):
+        self.codes = list(codes)
+        self.window = window
+        self.sums = sums
+        self.counts = counts
+        self.last_date = np.datetime64(last_date, 'ns')
+        self.periods = list(periods)
+        self._index = {code: i for i, code in enumerate(self.codes)}
+
+    @classmethod
+    def from_frame(cls, df, periods=MA_PERIODS):
+        """由按(ts_code, trade_date)排序的长表初始化, 只保留每只ETF最近 max(periods) 个收盘价"""
+        size = max(periods)
+        tail = df.groupby('ts_code', sort=True).tail(size)
+        matrix, rows, cols = stack_by_instrument(tail['ts_code'], tail['close'].to_numpy(dtype=np.float64))
+        codes = pd.unique(tail['ts_code'])
+
+        # 右对齐: 每只ETF最新的收盘价放在最后一列
+        lengths = np.bincount(cols, minlength=len(codes))
+        window = np.full((len(codes), size), np.nan)
+        window[cols, size - lengths[cols] + rows] = matrix[rows, cols]
+
+        state = cls(codes, window, None, None, df['trade_date'].max(), periods)
+        state.refresh()
+        return state
+
+    def refresh(self):
+        """由窗口重新计算各周期的和与有效个数, 消除滚动更新的累积误差"""
+        valid = ~np.isnan(self.window)
+        filled = np.where(valid, self.window, 0.0)
+        self.sums = np.stack([filled[:, -p:].sum(axis=1) for p in self.periods], axis=1)
+        self.counts = np.stack([valid[:, -p:].sum(axis=1) for p in self.periods], axis=1)
+
+    def __contains__(self, code):
+        return code in self._index
+
+    def merge(self, other):
+        """并入另一个状态中的新ETF(代码不重复)"""
+        new = [i for i, code in enumerate(other.codes) if code not in self._index]
+        self.codes += [other.codes[i] for i in new]
+        self.window = np.vstack([self.window, other.window[new]])
+        self.sums = np.vstack([self.sums, other.sums[new]])
+        self.counts = np.vstack([self.counts, other.counts[new]])
+        self._index = {code: i for i, code in enumerate(self.codes)}
+
+    def add(self, codes):
+        """以空窗口加入尚无历史数据的新ETF"""
+        codes = [code for code in dict.fromkeys(codes) if code not in self._index]
+        if codes:
+            n = len(codes)
+            self.codes += codes
+            self.window = np.vstack([self.window, np.full((n, self.window.shape[1]), np.nan)])
+            self.sums = np.vstack([self.sums, np.zeros((n, self.sums.shape[1]))])
+            self.counts = np.vstack([self.counts, np.zeros((n, self.counts.shape[1]), dtype=self.counts.dtype)])
+            self._index = {code: i for i, code in enumerate(self.codes)}
+
+    def update(self, df):
+        """按日期顺序滚入新数据, 返回按(trade_date, ts_code)排序并带 ma_bias_* 列的新数据
+
+        df需只包含状态中已有ETF、且晚于各自已处理日期的行。
+        """
+        df = df.sort_values(['trade_date', 'ts_code']).reset_index(drop=True)
+        idx = np.array([self._index[code] for code in df['ts_code']], dtype=np.int64)
+        closes = df['close'].to_numpy(dtype=np.float64)
+        dates = df['trade_date'].to_numpy()
+        bias = np.full((len(df), len(self.periods)), np.nan)
+        size = self.window.shape[1]
+
+        bounds = np.flatnonzero(dates[1:] != dates[:-1]) + 1
+        for rows in np.split(np.arange(len(df)), bounds):
+            if len(rows) == 0:
+                continue
+            etf, close = idx[rows], closes[rows]
+            incoming_valid = ~np.isnan(close)
+            incoming = np.where(incoming_valid, close, 0.0)
+
+            # 各周期窗口移出最旧的一个值, 移入当日收盘价
+            outgoing = self.window[etf][:, [size - p for p in self.periods]]
+            outgoing_valid = ~np.isnan(outgoing)
+            self.sums[etf] += incoming[:, None] - np.where(outgoing_valid, outgoing, 0.0)
+            self.counts[etf] += incoming_valid[:, None].astype(np.int64) - outgoing_valid
+
+            self.window[etf, :-1] = self.window[etf, 1:]
+            self.window[etf, -1] = close
+
+            periods = np.array(self.periods)
+            ma = np.where(self.counts[etf] == periods, self.sums[etf] / periods, np.nan)
+            bias[rows] = close[:, None] / ma
+
+        for i, period in enumerate(self.periods):
+            df[f'ma_bias_{period}'] = bias[:, i]
+        if len(df):
+            self.last_date = max(self.last_date, np.datetime64(dates.max(), 'ns'))
+        return df
+
+    def save(self, path):
+        """保存为压缩的npz检查点"""
+        self.refresh()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, codes=np.array(self.codes, dtype=str), window=self.window,
+                            sums=self.sums, counts=self.counts, last_date=self.last_date,
+                            periods=np.array(self.periods))
+
+    @classmethod
+    def load(cls, path):
+        """从npz检查点恢复"""
+        with np.load(path) as data:
+            return cls(data['codes'].tolist(), data['window'], data['sums'], data['counts'],
+                       data['last_date'], data['periods'].tolist())
+
+
+def daily_cross_section_topk(df, value_cols, k=5, code_col='ts_code', date_col='trade_date'):
+    """逐日截面前k名和后k名, 用argpartition部分选择, 不对整个截面排序
+
+    Returns:
+        dates: 交易日
+        instruments: ETF代码, 编码即其下标
+        ranks: {'top': (编码, 数值), 'bottom': (编码, 数值)}, 数组形状均为 (k, 交易日, 指标),
+            按名次排列(并列时代码靠前者在前), 当日有效值不足k个时编码为-1、数值为NaN
+    """
+    cube = FeatureCube.from_frame(df, fields=value_cols, instrument_col=code_col,
+                                  date_col=date_col, dtype=np.float64)
+    values = cube.values
+    missing = np.isnan(values)
+    k = min(k, len(cube.instruments))
+
+    ranks = {}
+    for side, sign in [('top', 1.0), ('bottom', -1.0)]:
+        # 统一转换为"越大越靠前", 缺失值排在最后
+        score = np.where(missing, -np.inf, sign * values)
+        if k == 0:
+            codes = np.empty((0,) + values.shape[1:], dtype=np.int64)
+        else:
+            codes = np.argpartition(-score, k - 1, axis=0)[:k]
+            codes.sort(axis=0)
+            order = np.argsort(-np.take_along_axis(score, codes, axis=0), axis=0, kind='stable')
+            codes = np.take_along_axis(codes, order, axis=0)
+        picked = np.take_along_axis(values, codes, axis=0)
+        invalid = np.isnan(picked)
+        codes[invalid] = -1
+        ranks[side] = (codes, picked)
+    return cube.dates, cube.instruments, ranks
+
+
+class DailyMaxReducer:
+    """合并按ETF分片计算的逐日截面最大值
+
+    各分片的ETF互不重叠; 分片按代码顺序加入时, 并列取代码靠前者的规则与整体计算一致。
+    内存只与交易日数和指标数有关, 与ETF总数无关。
+    """
+
+    def __init__(self, n_cols):
+        self.instruments = []
+        self.dates = pd.DatetimeIndex([])
+        self.codes = np.empty((0, n_cols), dtype=np.int64)
+        self.values = np.empty((0, n_cols))
+
+    def add(self, dates, instruments, codes, values):
+        """加入一个分片的 daily_cross_section_max 结果"""
+        codes = np.where(codes >= 0, codes + len(self.instruments), -1)
+        self.instruments.extend(instruments)
+
+        union = self.dates.union(pd.DatetimeIndex(dates))
+        merged_codes = np.full((len(union), self.codes.shape[1]), -1, dtype=np.int64)
+        merged_values = np.full((len(union), self.values.shape[1]), np.nan)
+        old_pos = union.get_indexer(self.dates)
+        merged_codes[old_pos] = self.codes
+        merged_values[old_pos] = self.values
+
+        # 只有严格更大才替换, 并列保留先加入的分片
+        new_pos = union.get_indexer(pd.DatetimeIndex(dates))
+        current = merged_values[new_pos]
+        better = values > np.where(np.isnan(current), -np.inf, current)
+        merged_values[new_pos] = np.where(better, values, current)
+        merged_codes[new_pos] = np.where(better, codes, merged_codes[new_pos])
+
+        self.dates, self.codes, self.values = union, merged_codes, merged_values
+
+    def result(self):
+        """返回与 daily_cross_section_max 相同格式的合并结果"""
+        return self.dates, pd.Index(self.instruments), self.codes, self.values
@@ -9,8 +9,24 @@ import numpy as np
 from pathlib import Path
 import glob
 import os,sys
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import *
+from qlib_workflow.data.raw_cache import parse_yyyymmdd, read_csv_cached
+from free_workflow.ma_bias_engine import (MA_PERIODS, DailyMaxReducer, RollingMAState,
+                                          calculate_ma_bias_columns, daily_cross_section_max,
+                                          daily_cross_section_topk)
+
+# 原始CSV的列式缓存目录, 设为None则每次重新解析
+RAW_CACHE_DIR = os.path.join(DIR_DATA, "../cache/raw")
+# 分析结果及增量模式的滚动状态检查点
+OUTPUT_FILE = os.path.join(DIR_DATA, "../research/etf_ma_bias_research.csv")
+TOPK_OUTPUT_FILE = os.path.join(DIR_DATA, "../research/etf_ma_bias_topk.csv")
+STATE_FILE = os.path.join(DIR_DATA, "../research/etf_ma_bias_state.npz")
+UNIVERSE_OUTPUT_FILE = os.path.join(DIR_DATA, "../research/etf_ma_bias_research_all.csv")
+
+# 参与每日最大偏离度分析的指标列
+BIAS_COLS = ['ma_bias_5', 'ma_bias_10', 'ma_bias_20', 'ma_bias_30', 'ma_bias_60', 'ma_bias_120']
 
 
 def load_etf_selection():
@@ -25,106 +41,216 @@ def load_etf_selection():
     print(f"选中的ETF数量: {len(selected_etfs)}")
     return selected_etfs, etf_name_map
 
-def load_etf_data(etf_codes):
-    """加载ETF历史数据"""
+def _load_etf_file(file_path, cache_dir):
+    """读取单只ETF文件的交易日和收盘价, 按日期升序返回 (日期数组, 收盘价数组)"""
+    df = read_csv_cached(file_path, cache_dir=cache_dir,
+                         date_formats={'trade_date': '%Y%m%d'},
+                         usecols=['trade_date', 'close'],
+                         dtype={'trade_date': np.int32, 'close': np.float64})
+    dates = df['trade_date'].to_numpy()
+    order = np.argsort(dates, kind='stable')
+    return dates[order], df['close'].to_numpy()[order]
+
+def load_etf_universe():
+    """加载全部ETF: etf_daily目录下的所有文件, 名称取自筛选列表(不限human标记)"""
+    data_dir = os.path.join(DIR_DATA, "etf_daily")
+    etf_codes = sorted(Path(f).stem for f in glob.glob(os.path.join(data_dir, "*.csv")))
+    
+    select_file = os.path.join(DIR_DATA, "../research/etf_human_select.csv")
+    etf_name_map = {}
+    if os.path.exists(select_file):
+        df = pd.read_csv(select_file)
+        etf_name_map = dict(zip(df['ts_code'], df['extname']))
+    print(f"全部ETF数量: {len(etf_codes)}")
+    return etf_codes, etf_name_map
+
+def load_etf_data(etf_codes, cache_dir=RAW_CACHE_DIR, max_workers=8):
+    """并发加载ETF历史数据, 只读取交易日和收盘价"""
     data_dir = os.path.join(DIR_DATA, "etf_daily")
-    all_data = []
-    
-    for etf_code in etf_codes:
-        file_path = f"{data_dir}/{etf_code}.csv"
-        if Path(file_path).exists():
-            try:
-                df = pd.read_csv(file_path)
-                df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
-                df = df[['ts_code', 'trade_date', 'close']].copy()
-                all_data.append(df)
-                print(f"加载 {etf_code}: {len(df)} 条记录")
-            except Exception as e:
-                print(f"加载 {etf_code} 失败: {e}")
-        else:
-            print(f"文件不存在: {file_path}")
-    
-    # 合并所有数据
-    if all_data:
-        combined_df = pd.concat(all_data, ignore_index=True)
-        combined_df = combined_df.sort_values(['ts_code', 'trade_date'])
-        print(f"总数据量: {len(combined_df)} 条")
-        return combined_df
-    else:
+    etf_codes = sorted(set(etf_codes))
+    failures = {}
+    
+    # 线程池并发读取, 单个文件失败不影响其余文件
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for etf_code in etf_codes:
+            file_path = f"{data_dir}/{etf_code}.csv"
+            if Path(file_path).exists():
+                futures[etf_code] = executor.submit(_load_etf_file, file_path, cache_dir)
+            else:
+                failures[etf_code] = f"文件不存在: {file_path}"
+    
+    loaded = {}
+    for etf_code, future in futures.items():
+        try:
+            loaded[etf_code] = future.result()
+        except Exception as e:
+            failures[etf_code] = f"加载失败: {e}"
+    
+    if failures:
+        print(f"⚠️ {len(failures)} 只ETF加载失败:")
+        for etf_code, reason in failures.items():
+            print(f"  {etf_code}: {reason}")
+    
+    if not loaded:
         return pd.DataFrame()
+    
+    # 按代码顺序写入预分配数组, 结果天然按(ts_code, trade_date)排序
+    codes = list(loaded)
+    lengths = np.array([len(loaded[code][0]) for code in codes])
+    total = int(lengths.sum())
+    trade_dates = np.empty(total, dtype='datetime64[ns]')
+    closes = np.empty(total, dtype=np.float64)
+    offset = 0
+    for code, length in zip(codes, lengths):
+        trade_dates[offset:offset + length], closes[offset:offset + length] = loaded[code]
+        offset += length
+    
+    combined_df = pd.DataFrame({
+        'ts_code': np.repeat(np.array(codes, dtype=object), lengths),
+        'trade_date': trade_dates,
+        'close': closes,
+    })
+    print(f"加载 {len(codes)} 只ETF, 总数据量: {len(combined_df)} 条")
+    return combined_df
+
+def _read_new_rows(file_path, last_date, chunksize=64):
+    """读取单只ETF文件中晚于last_date的行
+
+    文件按日期倒序(最新在前)时只读到last_date为止; 否则完整读取后过滤。
+    """
+    last = int(pd.Timestamp(last_date).strftime('%Y%m%d'))
+    parts = []
+    for chunk in pd.read_csv(file_path, usecols=['trade_date', 'close'],
+                             dtype={'trade_date': np.int32, 'close': np.float64},
+                             chunksize=chunksize):
+        dates = chunk['trade_date'].to_numpy()
+        parts.append(chunk[dates > last])
+        if (dates <= last).any() and (np.diff(dates) <= 0).all():
+            break
+    df = pd.concat(parts, ignore_index=True)
+    df['trade_date'] = parse_yyyymmdd(df['trade_date'].to_numpy())
+    return df.sort_values('trade_date')
+
+def load_etf_updates(etf_codes, last_date, max_workers=8):
+    """并发读取各ETF晚于last_date的新数据"""
+    data_dir = os.path.join(DIR_DATA, "etf_daily")
+    etf_codes = [code for code in sorted(set(etf_codes)) if Path(f"{data_dir}/{code}.csv").exists()]
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(lambda code: _read_new_rows(f"{data_dir}/{code}.csv", last_date), etf_codes))
+    
+    frames = [df.assign(ts_code=code) for code, df in zip(etf_codes, frames) if len(df)]
+    if not frames:
+        return pd.DataFrame(columns=['ts_code', 'trade_date', 'close'])
+    return pd.concat(frames, ignore_index=True)[['ts_code', 'trade_date', 'close']]
 
 def calculate_ma_bias(df):
     """计算均线偏离度指标"""
     print("计算均线偏离度指标...")
     
-    # 按ETF代码分组计算移动平均
-    periods = [5, 10, 20, 30, 60, 120, 200]
+    # 按ETF代码分组计算移动平均: 所有周期一次向量化计算
+    periods = MA_PERIODS
+    bias = calculate_ma_bias_columns(df['ts_code'], df['close'].to_numpy(), periods)
     
     for period in periods:
-        ma_col = f'ma_{period}'
         bias_col = f'ma_bias_{period}'
         
-        # 计算移动平均
-        df[ma_col] = df.groupby('ts_code')['close'].transform(
-            lambda x: x.rolling(window=period, min_periods=period).mean()
-        )
-        
         # 计算偏离度 (修正需求文档中的错误，应该是close/对应的ma)
-        df[bias_col] = df['close'] / df[ma_col]
+        df[bias_col] = bias[period]
         
         print(f"完成 {bias_col} 计算")
     
-    # 删除中间计算列
-    ma_cols = [f'ma_{p}' for p in periods]
-    df = df.drop(columns=ma_cols)
-    
     return df
 
 def analyze_daily_max_bias(df, etf_name_map):
     """分析每日偏离度最大的标的"""
     print("分析每日偏离度最大的标的...")
     
-    bias_cols = ['ma_bias_5', 'ma_bias_10', 'ma_bias_20', 'ma_bias_30', 'ma_bias_60', 'ma_bias_120']
+    bias_cols = BIAS_COLS
     
     # 只保留有完整指标的数据
     df_clean = df.dropna(subset=bias_cols).copy()
     print(f"有效数据量: {len(df_clean)}")
     
-    # 使用vectorized操作提高效率
-    daily_max = []
+    # 按(ETF, 交易日, 指标)构建稠密立方体, 沿ETF轴做截面argmax
+    dates, instruments, max_codes, max_values = daily_cross_section_max(df_clean, bias_cols)
     
-    # 按日期分组并使用idxmax()
-    grouped = df_clean.groupby('trade_date')
-    total_dates = len(grouped)
+    result_df = build_daily_max_frame(dates, instruments, max_codes, max_values, etf_name_map, bias_cols)
+    print(f"日级别分析结果: {len(result_df)} 个交易日")
+    return result_df
+
+def build_daily_max_frame(dates, instruments, max_codes, max_values, etf_name_map, bias_cols=BIAS_COLS):
+    """由逐日截面最大值的编码和数值生成结果表"""
+    # argmax结果即ETF的类别编码, 名称映射只对每只ETF做一次(找不到名称则保留代码)
+    etf_names = np.array([etf_name_map.get(code, code) for code in instruments], dtype=object)
     
-    for i, (date, group) in enumerate(grouped):
-        if i % 100 == 0:  # 每100天显示一次进度
-            print(f"处理进度: {i}/{total_dates} ({i/total_dates*100:.1f}%)")
-            
-        row = {'trade_date': date}
-        
-        for bias_col in bias_cols:
-            # 使用idxmax直接找到最大值的索引
-            max_idx = group[bias_col].idxmax()
-            etf_code = group.loc[max_idx, 'ts_code']
-            
-            # 使用ETF名称替代代码
-            etf_name = etf_name_map.get(etf_code, etf_code)  # 如果找不到名称则保留代码
-            
-            row[f'{bias_col}_max_etf'] = etf_name
-            row[f'{bias_col}_max_value'] = group.loc[max_idx, bias_col]
-        
-        daily_max.append(row)
+    daily_max = {'trade_date': dates}
+    for i, bias_col in enumerate(bias_cols):
+        daily_max[f'{bias_col}_max_etf'] = etf_names[max_codes[:, i]]
+        daily_max[f'{bias_col}_max_value'] = max_values[:, i]
     
     result_df = pd.DataFrame(daily_max)
-    result_df = result_df.sort_values('trade_date')
+    return result_df.sort_values('trade_date')
+
+def run_out_of_core(etf_codes, etf_name_map, shard_size=100):
+    """分片计算: 每次只加载 shard_size 只ETF, 计算偏离度和逐日局部最大值, 最后合并
+
+    峰值内存取决于分片大小而非ETF总数。
+    """
+    etf_codes = sorted(set(etf_codes))
+    shards = [etf_codes[i:i + shard_size] for i in range(0, len(etf_codes), shard_size)]
+    reducer = DailyMaxReducer(len(BIAS_COLS))
+    
+    for i, shard in enumerate(shards):
+        print(f"处理分片 {i + 1}/{len(shards)}: {len(shard)} 只ETF")
+        df = load_etf_data(shard)
+        if df.empty:
+            continue
+        df = calculate_ma_bias(df).dropna(subset=BIAS_COLS)
+        reducer.add(*daily_cross_section_max(df, BIAS_COLS))
+        del df
     
+    result_df = build_daily_max_frame(*reducer.result(), etf_name_map)
     print(f"日级别分析结果: {len(result_df)} 个交易日")
     return result_df
 
-def save_results(df):
+def analyze_daily_topk_bias(df, etf_name_map, k=5):
+    """分析每日偏离度前k名和后k名, 输出长表"""
+    print(f"分析每日偏离度前{k}名和后{k}名...")
+    
+    bias_cols = BIAS_COLS
+    df_clean = df.dropna(subset=bias_cols)
+    
+    dates, instruments, ranks = daily_cross_section_topk(df_clean, bias_cols, k)
+    etf_names = np.array([etf_name_map.get(code, code) for code in instruments] + [None], dtype=object)
+    instrument_codes = np.array(list(instruments) + [None], dtype=object)
+    
+    # (名次, 交易日, 指标) 三维结果展开为长表
+    frames = []
+    for side, (codes, values) in ranks.items():
+        n_rank, n_dates, n_cols = codes.shape
+        rank, date_idx, col_idx = np.meshgrid(np.arange(n_rank), np.arange(n_dates), np.arange(n_cols),
+                                              indexing='ij')
+        frames.append(pd.DataFrame({
+            'trade_date': dates[date_idx.ravel()],
+            'indicator': pd.Categorical.from_codes(col_idx.ravel(), bias_cols),
+            'side': side,
+            'rank': (rank.ravel() + 1).astype(np.int8),
+            'ts_code': instrument_codes[codes.ravel()],
+            'etf_name': etf_names[codes.ravel()],
+            'value': values.ravel(),
+        }))
+    
+    result_df = pd.concat(frames, ignore_index=True).dropna(subset=['value'])
+    result_df['side'] = result_df['side'].astype('category')
+    result_df = result_df.sort_values(['trade_date', 'indicator', 'side', 'rank'], kind='stable')
+    
+    print(f"排名结果: {len(result_df)} 行")
+    return result_df.reset_index(drop=True)
+
+def save_results(df, output_file=OUTPUT_FILE):
     """保存分析结果"""
-    output_file = os.path.join(DIR_DATA, "../research/etf_ma_bias_research.csv")
     
     # 确保目录存在
     Path(output_file).parent.mkdir(parents=True, exist_ok=True)
@@ -148,16 +274,60 @@ def save_results(df):
             for etf_name, count in top_etfs.items():
                 print(f"  {etf_name}: {count}次")
 
-def main():
+def run_incremental(etf_codes, etf_name_map):
+    """增量模式: 从检查点恢复滚动状态, 只计算最后一个输出日之后的交易日并追加到结果文件"""
+    state = RollingMAState.load(STATE_FILE)
+    last_date = pd.Timestamp(state.last_date)
+    print(f"从检查点恢复: {len(state.codes)} 只ETF, 已处理到 {last_date.strftime('%Y-%m-%d')}")
+    
+    # 新加入筛选列表的ETF: 用截至检查点日期的历史初始化状态
+    new_codes = [code for code in etf_codes if code not in state]
+    if new_codes:
+        history = load_etf_data(new_codes)
+        if not history.empty:
+            history = history[history['trade_date'] <= last_date]
+        if len(history):
+            state.merge(RollingMAState.from_frame(history))
+        state.add(new_codes)
+    
+    updates = load_etf_updates([code for code in etf_codes if code in state], last_date)
+    if updates.empty:
+        print(f"没有晚于 {last_date.strftime('%Y-%m-%d')} 的新数据")
+        return
+    
+    df = state.update(updates)
+    print(f"新增数据: {len(df)} 条, {df['trade_date'].nunique()} 个交易日")
+    daily_result = analyze_daily_max_bias(df, etf_name_map)
+    
+    # 追加写入结果, 再保存检查点
+    daily_result.to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+    state.last_date = np.datetime64(df['trade_date'].max(), 'ns')
+    state.save(STATE_FILE)
+    print(f"结果已追加到: {OUTPUT_FILE}")
+
+def main(incremental=False, topk=0, universe=False, shard_size=0):
     """主函数"""
     print("=== ETF均线偏离度分析研究 ===")
     
+    # 全量ETF分片计算, 结果单独保存
+    if shard_size > 0 or universe:
+        etf_codes, etf_name_map = load_etf_universe() if universe else load_etf_selection()
+        daily_result = run_out_of_core(etf_codes, etf_name_map, shard_size or 100)
+        save_results(daily_result, UNIVERSE_OUTPUT_FILE if universe else OUTPUT_FILE)
+        print("✅ 分片分析完成!")
+        return
+    
     # 1. 加载ETF筛选列表
     etf_codes, etf_name_map = load_etf_selection()
     if not etf_codes:
         print("❌ 没有找到需要分析的ETF")
         return
     
+    if incremental and os.path.exists(STATE_FILE) and os.path.exists(OUTPUT_FILE):
+        run_incremental(etf_codes, etf_name_map)
+        print("✅ 增量分析完成!")
+        return
+    
     # 2. 加载ETF数据
     df = load_etf_data(etf_codes)
     if df.empty:
@@ -170,10 +340,24 @@ def main():
     # 4. 分析每日最大偏离度
     daily_result = analyze_daily_max_bias(df, etf_name_map)
     
-    # 5. 保存结果
+    # 5. 保存结果, 并保存滚动状态供增量模式使用
     save_results(daily_result)
+    RollingMAState.from_frame(df).save(STATE_FILE)
+    
+    # 6. 可选: 每日前k名/后k名排名
+    if topk > 0:
+        topk_result = analyze_daily_topk_bias(df, etf_name_map, topk)
+        topk_result.to_csv(TOPK_OUTPUT_FILE, index=False)
+        print(f"排名结果已保存到: {TOPK_OUTPUT_FILE}")
     
     print("✅ 分析完成!")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="ETF均线偏离度分析研究")
+    parser.add_argument('--incremental', action='store_true', help="只计算检查点之后的新交易日并追加结果")
+    parser.add_argument('--topk', type=int, default=0, help="额外输出每日偏离度前k名和后k名")
+    parser.add_argument('--universe', action='store_true', help="分析etf_daily目录下的全部ETF(分片计算)")
+    parser.add_argument('--shard-size', type=int, default=0, help="按ETF分片计算, 每片的ETF数量")
+    args = parser.parse_args()
+    main(incremental=args.incremental, topk=args.topk, universe=args.universe, shard_size=args.shard_size)
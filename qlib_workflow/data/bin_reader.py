@@ -0,0 +1,108 @@
+"""
+轻量级本地bin特征读取器
+直接以np.memmap打开 ETFDataConverter 生成的 features/<inst>/<field>.day.bin,
+按 calendars/day.txt 二分查找日期区间, 不经过qlib的provider/表达式/缓存体系
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class BinFeatureReader:
+    """按日期区间读取原始字段的memmap读取器"""
+
+    def __init__(self, provider_uri="~/data/qlib_data/etf_data", freq="day"):
+        self.provider_uri = Path(provider_uri).expanduser()
+        self.freq = freq
+        self.calendar = self._load_calendar()
+        self._files = {}
+
+    def _load_calendar(self):
+        """加载交易日历"""
+        calendar_file = self.provider_uri / "calendars" / f"{self.freq}.txt"
+        with open(calendar_file, 'r') as f:
+            dates = [line.strip() for line in f if line.strip()]
+        return pd.DatetimeIndex(pd.to_datetime(dates))
+
+    def list_instruments(self, market="all"):
+        """读取股票池文件中的代码(只取第一列)"""
+        instruments_file = self.provider_uri / "instruments" / f"{market}.txt"
+        with open(instruments_file, 'r') as f:
+            return [line.split()[0] for line in f if line.strip()]
+
+    def list_instrument_spans(self, market="all"):
+        """读取股票池文件中的代码及上市区间 {代码: [(开始, 结束)]}; 只有代码一列的行区间为None(不限制)"""
+        instruments_file = self.provider_uri / "instruments" / f"{market}.txt"
+        spans = {}
+        with open(instruments_file, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if len(parts) < 3:
+                    spans[parts[0]] = None
+                elif spans.get(parts[0], []) is not None:
+                    spans.setdefault(parts[0], []).append((pd.Timestamp(parts[1]), pd.Timestamp(parts[2])))
+        return spans
+
+    def locate(self, start_time=None, end_time=None):
+        """二分查找日期区间在日历中的位置 [start, end)"""
+        start = 0 if start_time is None else self.calendar.searchsorted(pd.Timestamp(start_time), 'left')
+        end = len(self.calendar) if end_time is None else self.calendar.searchsorted(pd.Timestamp(end_time), 'right')
+        return int(start), int(end)
+
+    def open(self, instrument, field):
+        """打开bin文件, 返回 (起始日历索引, memmap数组); 文件不存在时返回 (0, None)"""
+        field = field.lstrip('$')
+        key = (instrument.lower(), field)
+        if key not in self._files:
+            bin_file = self.provider_uri / "features" / key[0] / f"{field}.{self.freq}.bin"
+            if not bin_file.exists() or bin_file.stat().st_size <= 4:
+                self._files[key] = (0, None)
+            else:
+                start_index = int(np.fromfile(bin_file, dtype='<f4', count=1)[0])
+                self._files[key] = (start_index, np.memmap(bin_file, dtype='<f4', mode='r', offset=4))
+        return self._files[key]
+
+    def read(self, instrument, field, start_time=None, end_time=None):
+        """读取单只ETF单个字段, 返回 (零拷贝数组, 对应日期)
+
+        数组为memmap切片, 只覆盖区间内实际有数据的部分。
+        """
+        start, end = self.locate(start_time, end_time)
+        start_index, data = self.open(instrument, field)
+        if data is None:
+            return np.empty(0, dtype='<f4'), self.calendar[:0]
+
+        lo = max(start, start_index)
+        hi = min(end, start_index + len(data))
+        if hi <= lo:
+            return data[:0], self.calendar[:0]
+        return data[lo - start_index:hi - start_index], self.calendar[lo:hi]
+
+    def read_matrix(self, instruments, field, start_time=None, end_time=None, dtype=np.float32):
+        """读取多只ETF单个字段, 返回 (交易日 x ETF) 矩阵, 缺失处为NaN"""
+        start, end = self.locate(start_time, end_time)
+        matrix = np.full((end - start, len(instruments)), np.nan, dtype=dtype)
+        for j, instrument in enumerate(instruments):
+            start_index, data = self.open(instrument, field)
+            if data is None:
+                continue
+            lo = max(start, start_index)
+            hi = min(end, start_index + len(data))
+            if hi > lo:
+                matrix[lo - start:hi - start, j] = data[lo - start_index:hi - start_index]
+        return matrix, self.calendar[start:end]
+
+    def read_frame(self, instruments, fields, start_time=None, end_time=None):
+        """读取宽表: 行为交易日; 单个字段时列为ETF, 多个字段时列为(字段, ETF)"""
+        if isinstance(instruments, str):
+            instruments = self.list_instruments(instruments)
+        if isinstance(fields, str):
+            matrix, dates = self.read_matrix(instruments, fields, start_time, end_time)
+            return pd.DataFrame(matrix, index=dates, columns=pd.Index(instruments, name='instrument'))
+
+        frames = {field: self.read_frame(instruments, field, start_time, end_time) for field in fields}
+        return pd.concat(frames, axis=1, names=['field', 'instrument'])
@@ -0,0 +1,74 @@
+"""
+紧凑数据类型模式
+浮点列降为float32, 代码/名称等字符串列和索引层级转为类别, 日期转为int32日历位置;
+日历保存在 df.attrs['calendar'], 需要真实日期时用 restore_dates 还原
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def memory_mb(df):
+    """DataFrame占用内存(MB), 包含索引和字符串对象"""
+    return df.memory_usage(index=True, deep=True).sum() / 1024 / 1024
+
+
+def _compact_values(values, calendar):
+    """单列或单个索引层级的紧凑表示"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        positions = calendar.get_indexer(pd.DatetimeIndex(values))
+        if (positions < 0).any():
+            raise ValueError("存在不在日历中的日期, 无法转换为日历位置")
+        return positions.astype(np.int32)
+    if pd.api.types.is_float_dtype(values):
+        return values.astype(np.float32)
+    if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+        return values.astype('category')
+    return values
+
+
+def compact_frame(df, calendar=None):
+    """转换为紧凑数据类型
+
+    Args:
+        df: 原始DataFrame, 日期可以是列也可以是索引层级
+        calendar: 日期位置所参照的交易日历, 默认取df中出现的全部日期
+
+    Returns:
+        新的DataFrame, attrs['calendar'] 为所用日历
+    """
+    date_columns = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    date_levels = [i for i, level in enumerate(df.index.levels if isinstance(df.index, pd.MultiIndex) else [df.index])
+                   if pd.api.types.is_datetime64_any_dtype(level)]
+    if calendar is None:
+        dates = [df[c].to_numpy() for c in date_columns] + \
+                [df.index.get_level_values(i).unique().to_numpy() for i in date_levels]
+        calendar = np.unique(np.concatenate(dates)) if dates else []
+    calendar = pd.DatetimeIndex(calendar)
+
+    if isinstance(df.index, pd.MultiIndex):
+        # MultiIndex本身按层级编码存储, 只需转换各层级的取值
+        index = df.index.set_levels([_compact_values(pd.Index(level), calendar) for level in df.index.levels])
+    else:
+        index = pd.Index(_compact_values(df.index, calendar), name=df.index.name)
+
+    result = pd.DataFrame({c: _compact_values(df[c], calendar) for c in df.columns}, copy=False)
+    result.index = index
+    result.attrs['calendar'] = calendar
+    return result
+
+
+def restore_dates(df, values):
+    """把紧凑帧中的日历位置还原为日期; 普通帧原样返回"""
+    calendar = df.attrs.get('calendar')
+    if calendar is None:
+        return values
+    return calendar[np.asarray(values, dtype=np.int64)]
+
+
+def memory_report(name, before, after):
+    """打印并返回紧凑前后的内存占用"""
+    before_mb, after_mb = memory_mb(before), memory_mb(after)
+    saved = 1 - after_mb / before_mb if before_mb > 0 else 0.0
+    print(f"内存占用 {name}: {before_mb:.1f}MB -> {after_mb:.1f}MB (减少 {saved:.0%})")
+    return {'frame': name, 'before_mb': before_mb, 'after_mb': after_mb, 'saved': saved}
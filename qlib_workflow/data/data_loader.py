@@ -1,31 +1,149 @@
+import numpy as np
+import pandas as pd
 import qlib
 from qlib.data import D
 
+from .compact import compact_frame, memory_report
+from .result_cache import ResultCache
+from .sharded_fetch import resolve_instruments, sharded_features, subset_instruments
+
 class DataLoader:
-    def __init__(self, instruments="csi300", start_time="2008-01-01", end_time="2020-08-01"):
+    def __init__(self, instruments="csi300", start_time="2008-01-01", end_time="2020-08-01", cache=True,
+                 compact=False, max_workers=1):
+        """
+        cache: True 使用默认的两级缓存(内存LRU + 磁盘), False 不缓存, 也可传入 ResultCache 实例在多个加载器间共享
+        compact: 为True时返回紧凑帧(float32、类别代码、int32日历位置, 日历见 attrs['calendar'])
+        max_workers: 大于1时按股票分片在进程池中并行查询
+        """
         self.instruments = instruments
         self.start_time = start_time
         self.end_time = end_time
-    
+        self.compact = compact
+        self.max_workers = max_workers
+        # 最近一次分片查询的各分片耗时
+        self.shard_timings = None
+        if cache is True:
+            cache = ResultCache()
+        self.cache = cache or None
+
+    def _features(self, fields, instruments=None, start_time=None, end_time=None, use_cache=True):
+        """查询特征(默认取加载器的股票池和区间), 命中缓存时不调用 D.features; use_cache=False 时不读写缓存"""
+        instruments = self.instruments if instruments is None else instruments
+        start_time = self.start_time if start_time is None else start_time
+        end_time = self.end_time if end_time is None else end_time
+
+        def query():
+            if self.max_workers > 1:
+                data, self.shard_timings = sharded_features(instruments, fields, start_time, end_time,
+                                                            max_workers=self.max_workers)
+                return data
+            return D.features(
+                instruments=instruments,
+                fields=fields,
+                start_time=start_time,
+                end_time=end_time
+            )
+
+        if self.cache is None or not use_cache:
+            data = query()
+        else:
+            from qlib.config import C
+            key = self.cache.make_key(C.dpm.get_data_uri('day'), instruments, fields, start_time, end_time)
+            data = self.cache.get_or_load(key, query)
+
+        if self.compact:
+            compact = compact_frame(data, calendar=D.calendar(freq='day'))
+            memory_report(f"{len(fields)} fields", data, compact)
+            data = compact
+        return data
+
     def load_data(self, fields=None):
         """加载股票数据"""
         if fields is None:
             fields = ["$open", "$high", "$low", "$close", "$volume"]
-        
-        data = D.features(
-            instruments=self.instruments,
-            fields=fields,
-            start_time=self.start_time,
-            end_time=self.end_time
-        )
+
+        data = self._features(fields)
         return data
-    
+
     def load_labels(self, label_expr="Ref($close, -1)/$close - 1"):
         """加载标签数据"""
-        labels = D.features(
-            instruments=self.instruments,
-            fields=[label_expr],
-            start_time=self.start_time,
-            end_time=self.end_time
-        )
-        return labels 
\ No newline at end of file
+        labels = self._features([label_expr])
+        return labels
+
+    def load_data_and_labels(self, fields=None, label_exprs=("Ref($close, -1)/$close - 1",)):
+        """一次查询同时加载特征和标签
+
+        特征与标签表达式去重后只调用一次 D.features; 查询时特征列在前、其余标签列在后,
+        返回的两个DataFrame是同一结果的列切片, 行索引一致, 不复制数据
+        (标签与特征有重复表达式时, 标签改为按列选取)。
+
+        Returns:
+            (features, labels)
+        """
+        if fields is None:
+            fields = ["$open", "$high", "$low", "$close", "$volume"]
+        fields, label_exprs = list(dict.fromkeys(fields)), list(dict.fromkeys(label_exprs))
+        extra_labels = [expr for expr in label_exprs if expr not in fields]
+
+        data = self._features(fields + extra_labels)
+        features = data.iloc[:, :len(fields)]
+        if extra_labels == label_exprs:
+            labels = data.iloc[:, len(fields):]
+        else:
+            labels = data[label_exprs]
+        return features, labels
+
+    def cache_stats(self):
+        """缓存命中统计"""
+        return self.cache.stats() if self.cache is not None else {}
+
+    def _time_slices(self, time_slice):
+        """把区间按交易日数(int)或日历周期('Y'/'Q'/'M')切分为 [(开始, 结束)]"""
+        dates = pd.DatetimeIndex(D.calendar(start_time=self.start_time, end_time=self.end_time))
+        if len(dates) == 0:
+            return []
+        if time_slice is None:
+            return [(dates[0], dates[-1])]
+        if isinstance(time_slice, int):
+            bounds = np.arange(0, len(dates), time_slice)
+            return [(dates[a], dates[min(a + time_slice, len(dates)) - 1]) for a in bounds]
+        periods = dates.to_period(time_slice)
+        starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+        ends = np.r_[starts[1:], len(dates)] - 1
+        return [(dates[a], dates[b]) for a, b in zip(starts, ends)]
+
+    def _instrument_batches(self, instrument_batch):
+        """按批次切分股票池; 股票池名称和配置展开为 {代码: 上市区间}, 各批次保留各自的区间"""
+        if instrument_batch is None:
+            return [self.instruments]
+        from qlib.config import C
+        instruments = resolve_instruments(self.instruments, C.dpm.get_data_uri('day'))
+        codes = list(instruments)
+        return [subset_instruments(instruments, codes[i:i + instrument_batch])
+                for i in range(0, len(codes), instrument_batch)]
+
+    def iter_data(self, fields=None, time_slice='Y', instrument_batch=None):
+        """按时间片和股票批次逐块返回数据, 内存占用只与单块大小有关
+
+        各块不经过结果缓存, 避免流式读取的数据占满内存LRU或在磁盘上再存一份;
+        qlib按表达式所需的回看/前瞻长度自动扩展每块的读取区间,
+        因此各块拼接并 sort_index() 后与 load_data 的整体结果完全一致
+        (块按时间片在外、股票批次在内的顺序产出)。
+
+        Args:
+            fields: 字段表达式, 可以包含标签表达式
+            time_slice: 每块的交易日数(int)或日历周期('Y'/'Q'/'M'), None为不切分
+            instrument_batch: 每批ETF/股票数, None为不切分
+
+        Yields:
+            (开始日期, 结束日期, DataFrame)
+        """
+        if fields is None:
+            fields = ["$open", "$high", "$low", "$close", "$volume"]
+
+        batches = self._instrument_batches(instrument_batch)
+        for start_time, end_time in self._time_slices(time_slice):
+            for instruments in batches:
+                data = self._features(fields, instruments, start_time, end_time, use_cache=False)
+                if len(data) > 0:
+                    yield start_time, end_time, data
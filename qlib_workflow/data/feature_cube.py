@@ -0,0 +1,77 @@
+"""
+ETF x 交易日 x 字段 的稠密数据立方体
+把(ts_code, trade_date)长表一次性转换为numpy三维数组, 缺失位置为NaN;
+写bin文件和研究分析都直接取其视图, 不再逐只ETF reindex
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureCube:
+    """稠密数据立方体, values形状为 (ETF数, 交易日数, 字段数)"""
+
+    def __init__(self, values, instruments, dates, fields):
+        self.values = values
+        self.instruments = pd.Index(instruments)
+        self.dates = pd.DatetimeIndex(dates)
+        self.fields = list(fields)
+
+    @classmethod
+    def from_frame(cls, df, fields=None, instrument_col='ts_code', date_col='trade_date',
+                   dtype=np.float32, calendar=None):
+        """从长表构建立方体
+
+        Args:
+            df: 长表, ETF代码和日期可以是列也可以是索引层级
+            fields: 需要的字段列, 默认取全部数值列
+            dtype: 立方体数值类型, 写bin用float32, 研究计算可用float64
+            calendar: 紧凑帧的日历(日期列为日历位置时传入 df.attrs['calendar'])
+        """
+        inst_values = cls._column(df, instrument_col)
+        date_values = cls._column(df, date_col)
+        if fields is None:
+            fields = [c for c in df.columns
+                      if c not in (instrument_col, date_col) and pd.api.types.is_numeric_dtype(df[c])]
+
+        # 用整数编码定位, 代替MultiIndex查找
+        inst_codes, instruments = pd.factorize(inst_values, sort=True)
+        date_codes, dates = pd.factorize(date_values, sort=True)
+        # 紧凑模式下日期为日历位置
+        if calendar is not None:
+            dates = pd.DatetimeIndex(calendar)[np.asarray(dates, dtype=np.int64)]
+
+        values = np.full((len(instruments), len(dates), len(fields)), np.nan, dtype=dtype)
+        values[inst_codes, date_codes] = df[fields].to_numpy(dtype=dtype)
+        return cls(values, instruments, dates, fields)
+
+    @staticmethod
+    def _column(df, name):
+        """取列或同名索引层级"""
+        if name in df.columns:
+            return df[name].to_numpy()
+        return df.index.get_level_values(name).to_numpy()
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def field(self, name):
+        """单个字段的 (ETF, 交易日) 视图"""
+        return self.values[:, :, self.fields.index(name)]
+
+    def instrument(self, code):
+        """单只ETF的 (交易日, 字段) 视图"""
+        return self.values[self.instruments.get_loc(code)]
+
+    def to_frame(self, name):
+        """单个字段的宽表: 行为交易日, 列为ETF(不复制数据)"""
+        return pd.DataFrame(self.field(name).T, index=self.dates, columns=self.instruments, copy=False)
+
+    def to_long(self, fields=None, dropna=True):
+        """还原为(ts_code, trade_date)索引的长表"""
+        fields = self.fields if fields is None else list(fields)
+        columns = [self.fields.index(f) for f in fields]
+        index = pd.MultiIndex.from_product([self.instruments, self.dates], names=['ts_code', 'trade_date'])
+        df = pd.DataFrame(self.values[:, :, columns].reshape(-1, len(columns)), index=index, columns=fields)
+        return df.dropna(how='all') if dropna else df
@@ -0,0 +1,199 @@
+"""
+原始CSV数据的列式缓存
+首次读取时把解析好的数据按列保存为npy文件, 之后以memmap方式加载;
+缓存以源文件路径、大小、修改时间为键, 源文件变化后自动失效
+"""
+
+import hashlib
+import io
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_CACHE_DIR = "~/.cache/qlib_projs/raw_cache"
+
+
+def source_fingerprint(source_file):
+    """源文件指纹: (绝对路径, 文件大小, 修改时间)"""
+    source_file = Path(source_file).expanduser().resolve()
+    stat = source_file.stat()
+    return str(source_file), stat.st_size, stat.st_mtime_ns
+
+
+def _cache_entry(source_file, cache_dir, options):
+    """缓存目录: <文件名>-<路径哈希>-<指纹与读取参数哈希>"""
+    path, size, mtime = source_fingerprint(source_file)
+    path_key = hashlib.sha1(path.encode()).hexdigest()[:12]
+    version_key = hashlib.sha1(
+        json.dumps([size, mtime, options], sort_keys=True, default=str).encode()
+    ).hexdigest()[:12]
+    prefix = f"{Path(path).stem}-{path_key}"
+    return Path(cache_dir).expanduser() / f"{prefix}-{version_key}", prefix
+
+
+def save_columns(df, entry_dir, extra_meta=None):
+    """把DataFrame按列保存为npy文件, 字符串列保存为编码+类别; extra_meta 一并写入meta.json"""
+    tmp_dir = entry_dir.with_name(entry_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    columns = []
+    for i, (name, series) in enumerate(df.items()):
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+            np.save(tmp_dir / f"{i}.npy", series.to_numpy())
+            columns.append({'name': name, 'kind': 'array'})
+        else:
+            codes, categories = pd.factorize(series)
+            np.save(tmp_dir / f"{i}.npy", codes.astype(np.int32))
+            np.save(tmp_dir / f"{i}.categories.npy", np.asarray(categories, dtype=str))
+            columns.append({'name': name, 'kind': 'categories'})
+
+    with open(tmp_dir / "meta.json", 'w') as f:
+        json.dump({'columns': columns, 'rows': len(df), **(extra_meta or {})}, f, ensure_ascii=False)
+    # 写完再改名, 中途失败不会留下半个缓存
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    tmp_dir.rename(entry_dir)
+
+
+def load_columns(entry_dir):
+    """以memmap方式加载列式缓存"""
+    with open(entry_dir / "meta.json", 'r') as f:
+        meta = json.load(f)
+
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        values = np.load(entry_dir / f"{i}.npy", mmap_mode='r')
+        if column['kind'] == 'categories':
+            categories = pd.Index(np.load(entry_dir / f"{i}.categories.npy"))
+            values = pd.Categorical.from_codes(values, categories).astype(categories.dtype)
+        data[column['name']] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def read_csv_cached(source_file, cache_dir=DEFAULT_CACHE_DIR, date_formats=None, **read_kwargs):
+    """读取CSV并使用列式缓存
+
+    Args:
+        source_file: CSV文件路径
+        cache_dir: 缓存目录, 为None时不使用缓存
+        date_formats: 需要解析为日期的列及其格式, 如 {'trade_date': '%Y%m%d'}
+        read_kwargs: 透传给 pd.read_csv 的参数(会参与缓存键)
+    """
+    date_formats = date_formats or {}
+    if cache_dir is None:
+        return _read_csv(source_file, date_formats, read_kwargs)
+
+    entry_dir, prefix = _cache_entry(source_file, cache_dir, [date_formats, read_kwargs])
+    if (entry_dir / "meta.json").exists():
+        return load_columns(entry_dir)
+
+    df = _read_csv(source_file, date_formats, read_kwargs)
+    # 清理同一源文件的过期缓存
+    for stale in entry_dir.parent.glob(f"{prefix}-*"):
+        shutil.rmtree(stale, ignore_errors=True)
+    save_columns(df, entry_dir)
+    return df
+
+
+def parse_yyyymmdd(values):
+    """把yyyymmdd格式的整数日期直接算成datetime64, 不经过字符串解析"""
+    values = np.asarray(values, dtype=np.int64)
+    years = (values // 10000 - 1970).astype('datetime64[Y]')
+    months = (values // 100 % 100 - 1).astype('timedelta64[M]')
+    days = (values % 100 - 1).astype('timedelta64[D]')
+    return (years + months + days).astype('datetime64[ns]')
+
+
+def _scan_block(block, column, threshold):
+    """在一段以完整行结尾的字节中定位yyyymmdd日期列大于threshold的行, 返回选中行的字节; 格式不符时返回None"""
+    ends = np.flatnonzero(block == ord('\n')) + 1
+    if len(ends) == 0 or ends[-1] != len(block):
+        ends = np.append(ends, len(block))
+    starts = np.r_[0, ends[:-1]]
+    # 跳过空行
+    nonblank = ends - starts > 2
+    starts, ends = starts[nonblank], ends[nonblank]
+    if len(starts) == 0:
+        return block[:0]
+
+    if column == 0:
+        date_starts = starts
+    else:
+        commas = np.flatnonzero(block == ord(','))
+        nth = np.searchsorted(commas, starts) + column - 1
+        if nth[-1] >= len(commas):
+            return None
+        date_starts = commas[nth] + 1
+    digits = block[np.minimum(date_starts[:, None] + np.arange(9), len(block) - 1)].astype(np.int64)
+    terminator = digits[:, 8]
+    digits = digits[:, :8] - ord('0')
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1) & (date_starts + 8 < ends) & \
+            np.isin(terminator, [ord(','), ord('\n'), ord('\r')])
+    if not valid.all():
+        return None
+    values = digits @ (10 ** np.arange(7, -1, -1))
+
+    selected = values > threshold
+    if not selected.any():
+        return block[:0]
+    # 选中行的字节区间: 起点+1, 终点-1, 前缀和>0即在区间内
+    marks = np.zeros(len(block) + 1, dtype=np.int8)
+    marks[starts[selected]] += 1
+    marks[ends[selected]] -= 1
+    keep = np.cumsum(marks[:-1], dtype=np.int8) > 0
+    return block[keep]
+
+
+def read_rows_after(source_file, date_column, threshold, block_bytes=64 * 1024 ** 2, **read_kwargs):
+    """只解析yyyymmdd日期列晚于threshold的行
+
+    以memmap按块扫描原始字节, 向量化取出每行的日期并只把选中的行交给pandas解析,
+    耗时主要与新增行数有关; 日期列不是无引号的8位数字等无法按字节定位时返回None。
+    """
+    source_file = Path(source_file).expanduser()
+    if source_file.stat().st_size == 0:
+        return None
+    data = np.memmap(source_file, dtype=np.uint8, mode='r')
+    header_end = int(np.argmax(data[:1024 ** 2] == ord('\n'))) + 1
+    if header_end == 1 and data[0] != ord('\n'):
+        return None
+    header = bytes(data[:header_end])
+    columns = header.decode().strip().split(',')
+    if date_column not in columns:
+        return None
+    column = columns.index(date_column)
+
+    parts = []
+    pos = header_end
+    while pos < len(data):
+        end = min(pos + block_bytes, len(data))
+        if end < len(data):
+            # 块结尾对齐到完整行
+            newline = np.flatnonzero(data[end:end + 1024 ** 2] == ord('\n'))
+            if len(newline) == 0:
+                return None
+            end += int(newline[0]) + 1
+        part = _scan_block(np.asarray(data[pos:end]), column, threshold)
+        if part is None:
+            return None
+        if len(part) > 0:
+            parts.append(part.tobytes())
+            if not parts[-1].endswith(b'\n'):
+                parts[-1] += b'\n'
+        pos = end
+    return pd.read_csv(io.BytesIO(header + b''.join(parts)), **read_kwargs)
+
+
+def _read_csv(source_file, date_formats, read_kwargs):
+    """解析CSV并转换日期列"""
+    df = pd.read_csv(Path(source_file).expanduser(), **read_kwargs)
+    for column, date_format in date_formats.items():
+        if date_format == '%Y%m%d' and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = parse_yyyymmdd(df[column].to_numpy())
+        else:
+            df[column] = pd.to_datetime(df[column], format=date_format)
+    return df
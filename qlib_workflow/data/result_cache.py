@@ -0,0 +1,163 @@
+"""
+qlib查询结果的两级缓存
+第一级为按字节预算淘汰的内存LRU, 第二级为磁盘列式存储(复用 raw_cache 的按列npy格式);
+缓存键包含数据版本指纹(日历、股票池与所用bin文件的大小和修改时间), 数据更新后旧结果不会被命中
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+from .raw_cache import load_columns, save_columns
+
+
+DEFAULT_RESULT_CACHE_DIR = "~/.cache/qlib_projs/result_cache"
+
+
+def _stat_key(path):
+    """(大小, 修改时间), 文件不存在时为None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def data_version(provider_uri, instruments, fields, freq='day'):
+    """数据版本指纹: 日历文件、股票池文件及查询涉及的每个bin文件的大小和修改时间"""
+    provider_uri = Path(provider_uri).expanduser()
+    parts = [_stat_key(provider_uri / "calendars" / f"{freq}.txt")]
+
+    if isinstance(instruments, str):
+        instruments_file = provider_uri / "instruments" / f"{instruments}.txt"
+        parts.append(_stat_key(instruments_file))
+        with open(instruments_file, 'r') as f:
+            instruments = [line.split()[0] for line in f if line.strip()]
+    elif isinstance(instruments, dict):
+        if 'market' in instruments:
+            # D.instruments() 返回的股票池配置
+            return data_version(provider_uri, instruments['market'], fields, freq)
+        # {代码: 上市区间}: 只涉及这些代码的bin文件, 区间本身已包含在查询哈希中
+        instruments = list(instruments)
+
+    raw_fields = sorted({name for field in fields for name in re.findall(r"\$(\w+)", field)})
+    features_dir = provider_uri / "features"
+    for instrument in sorted(instruments):
+        for field in raw_fields:
+            parts.append(_stat_key(features_dir / instrument.lower() / f"{field}.{freq}.bin"))
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """内存LRU + 磁盘列式存储的查询结果缓存"""
+
+    def __init__(self, memory_budget_mb=512, cache_dir=DEFAULT_RESULT_CACHE_DIR):
+        """
+        Args:
+            memory_budget_mb: 内存缓存的字节预算, 超出时淘汰最久未使用的结果
+            cache_dir: 磁盘缓存目录, 为None时只使用内存缓存
+        """
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.cache_dir = None if cache_dir is None else Path(cache_dir).expanduser()
+        self._memory = OrderedDict()
+        self.memory_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(provider_uri, instruments, fields, start_time, end_time, freq='day'):
+        """缓存键: <查询哈希>-<数据版本>; 同一查询的旧版本磁盘缓存以查询哈希为前缀清理"""
+        query = json.dumps([str(provider_uri), instruments, list(fields), str(start_time), str(end_time), freq],
+                           sort_keys=True, default=str)
+        query_key = hashlib.sha1(query.encode()).hexdigest()[:16]
+        return f"{query_key}-{data_version(provider_uri, instruments, fields, freq)}"
+
+    def get(self, key):
+        """读取缓存, 未命中返回None"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return self._memory[key][0].copy(deep=False)
+
+        entry_dir = self._entry_dir(key)
+        if entry_dir is not None and (entry_dir / "meta.json").exists():
+            df = self._load_entry(entry_dir)
+            self.disk_hits += 1
+            self._remember(key, df)
+            return df.copy(deep=False)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, df):
+        """写入内存与磁盘缓存"""
+        self._remember(key, df)
+        entry_dir = self._entry_dir(key)
+        if entry_dir is not None:
+            # 清理同一查询的旧版本
+            query_key = key.split('-')[0]
+            for stale in entry_dir.parent.glob(f"{query_key}-*"):
+                if stale != entry_dir:
+                    shutil.rmtree(stale, ignore_errors=True)
+            index_names = [name or f"level_{i}" for i, name in enumerate(df.index.names)]
+            frame = df.copy(deep=False)
+            frame.index.names = index_names
+            save_columns(frame.reset_index(), entry_dir,
+                         extra_meta={'index': index_names, 'column_order': [str(c) for c in df.columns]})
+
+    def get_or_load(self, key, loader):
+        """命中则返回缓存, 否则调用 loader() 并写入缓存"""
+        df = self.get(key)
+        if df is None:
+            df = loader()
+            self.put(key, df)
+            df = df.copy(deep=False)
+        return df
+
+    def stats(self):
+        """命中统计"""
+        requests = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / requests if requests else 0.0,
+            'memory_entries': len(self._memory),
+            'memory_mb': self.memory_bytes / 1024 / 1024,
+        }
+
+    def clear(self, disk=False):
+        """清空内存缓存, disk=True 时同时删除磁盘缓存"""
+        self._memory.clear()
+        self.memory_bytes = 0
+        if disk and self.cache_dir is not None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _entry_dir(self, key):
+        return None if self.cache_dir is None else self.cache_dir / key
+
+    def _remember(self, key, df):
+        """放入内存LRU并按字节预算淘汰"""
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if key in self._memory:
+            self.memory_bytes -= self._memory.pop(key)[1]
+        if nbytes > self.memory_budget:
+            return
+        self._memory[key] = (df, nbytes)
+        self.memory_bytes += nbytes
+        while self.memory_bytes > self.memory_budget:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self.memory_bytes -= evicted
+
+    @staticmethod
+    def _load_entry(entry_dir):
+        with open(entry_dir / "meta.json", 'r') as f:
+            meta = json.load(f)
+        df = load_columns(entry_dir).set_index(meta['index'])
+        df.columns = meta['column_order']
+        return df
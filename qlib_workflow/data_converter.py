@@ -2,35 +2,71 @@ import pandas as pd
 import qlib
 from qlib.data import D
 import numpy as np
-import struct
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+try:
+    from .data.compact import compact_frame, memory_report, restore_dates
+    from .data.feature_cube import FeatureCube
+    from .data.raw_cache import DEFAULT_CACHE_DIR, parse_yyyymmdd, read_csv_cached, read_rows_after
+except ImportError:
+    # 作为脚本直接运行(或以qlib_workflow目录为导入根)时没有父包
+    from data.compact import compact_frame, memory_report, restore_dates
+    from data.feature_cube import FeatureCube
+    from data.raw_cache import DEFAULT_CACHE_DIR, parse_yyyymmdd, read_csv_cached, read_rows_after
+
+
+# qlib字段映射
+FIELD_MAPPING = {
+    'open': 'open',
+    'high': 'high', 
+    'low': 'low',
+    'close': 'close',
+    'vol': 'volume',
+    'amount': 'money'
+}
+
 
 class ETFDataConverter:
     def __init__(self, source_file="~/data/quant/raw/etf_daily.csv", 
-                 output_dir="~/data/qlib_data/etf_data"):
+                 output_dir="~/data/qlib_data/etf_data", max_workers=1,
+                 cache_dir=DEFAULT_CACHE_DIR, compact=False):
         self.source_file = Path(source_file).expanduser()
         self.output_dir = Path(output_dir).expanduser()
+        # 并行转换的进程数, <=1 时逐只串行转换
+        self.max_workers = max_workers
+        # 原始数据列式缓存目录, None表示不缓存
+        self.cache_dir = cache_dir
+        # 紧凑模式: 浮点列float32, 代码和名称为类别, 日期为int32日历位置
+        self.compact = compact
         
     def load_raw_data(self):
         """加载原始ETF数据"""
-        df = pd.read_csv(self.source_file)
-        
-        # 数据预处理
-        df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
+        # 读取并预处理(解析结果走列式缓存)
+        df = read_csv_cached(self.source_file, cache_dir=self.cache_dir,
+                             date_formats={'trade_date': '%Y%m%d'})
         df = df.set_index(['ts_code', 'trade_date']).sort_index()
         
+        if self.compact:
+            compact = compact_frame(df)
+            memory_report('raw_data', df, compact)
+            df = compact
+        
         return df
     
     def create_calendar(self, df):
         """创建日历文件"""
+        # 获取所有交易日期(紧凑帧的日历位置还原为日期)
+        all_dates = restore_dates(df, df.index.get_level_values(1).unique().sort_values())
+        return self.write_calendar(all_dates)
+    
+    def write_calendar(self, all_dates):
+        """保存日历文件"""
         calendar_dir = self.output_dir / "calendars"
         calendar_dir.mkdir(parents=True, exist_ok=True)
         
-        # 获取所有交易日期
-        all_dates = df.index.get_level_values(1).unique().sort_values()
-        
-        # 保存日历文件
         calendar_file = calendar_dir / "day.txt"
         with open(calendar_file, 'w') as f:
             for date in all_dates:
@@ -41,13 +77,15 @@ class ETFDataConverter:
     
     def create_instruments(self, df):
         """创建股票池文件"""
-        instruments_dir = self.output_dir / "instruments"
-        instruments_dir.mkdir(parents=True, exist_ok=True)
-        
         # 获取所有ETF代码
         all_instruments = df.index.get_level_values(0).unique().sort_values()
+        return self.write_instruments(all_instruments)
+    
+    def write_instruments(self, all_instruments):
+        """保存股票池文件"""
+        instruments_dir = self.output_dir / "instruments"
+        instruments_dir.mkdir(parents=True, exist_ok=True)
         
-        # 保存所有ETF文件
         instruments_file = instruments_dir / "all.txt"
         with open(instruments_file, 'w') as f:
             for instrument in all_instruments:
@@ -56,70 +94,282 @@ class ETFDataConverter:
         print(f"创建股票池文件: {instruments_file}")
         return all_instruments
     
-    def save_feature_bin(self, data, output_file):
-        """保存特征数据为bin格式"""
+    def save_feature_bin(self, data, output_file, start_index=0):
+        """保存特征数据为bin格式
+
+        qlib的bin格式: 首个float32为该序列在日历中的起始索引, 其后为小端float32数据。
+        整列一次性转换为连续数组后单次写出, NaN原样保留。
+        """
+        values = np.asarray(data, dtype='<f4')
         with open(output_file, 'wb') as f:
-            for value in data:
-                if pd.isna(value):
-                    # NaN值用特殊标记
-                    f.write(struct.pack('<f', float('nan')))
-                else:
-                    f.write(struct.pack('<f', float(value)))
+            np.array([start_index], dtype='<f4').tofile(f)
+            values.tofile(f)
+    
+    def append_feature_bin(self, data, output_file, calendar_end):
+        """向已有bin文件末尾追加数据
+
+        calendar_end为追加前的日历长度; 已有数据若未覆盖到该位置, 先用NaN补齐, 保证与日历对齐。
+        """
+        start_index = int(np.fromfile(output_file, dtype='<f4', count=1)[0])
+        n_existing = output_file.stat().st_size // 4 - 1
+        gap = calendar_end - (start_index + n_existing)
+        if gap < 0:
+            raise ValueError(f"{output_file} 的数据长度超出现有日历, 无法追加")
+        
+        values = np.asarray(data, dtype='<f4')
+        with open(output_file, 'ab') as f:
+            np.full(gap, np.nan, dtype='<f4').tofile(f)
+            values.tofile(f)
     
-    def convert_to_qlib_format(self):
+    def build_cube(self, df):
+        """把长表一次性转换为 ETF x 交易日 x 字段 的float32立方体"""
+        csv_fields = [f for f in FIELD_MAPPING if f in df.columns]
+        return FeatureCube.from_frame(df, fields=csv_fields, calendar=df.attrs.get('calendar'))
+    
+    def save_instrument_batch(self, features_dir, instruments, values, qlib_fields):
+        """保存一批ETF的全部字段bin文件(可在子进程中执行), values形状为 (ETF, 交易日, 字段)"""
+        for instrument, block in zip(instruments, values):
+            instrument_dir = features_dir / instrument.lower()
+            instrument_dir.mkdir(exist_ok=True)
+            
+            for i, qlib_field in enumerate(qlib_fields):
+                self.save_feature_bin(block[:, i], instrument_dir / f"{qlib_field}.day.bin")
+        return len(instruments)
+    
+    def convert_to_qlib_format(self, max_workers=None):
         """转换为qlib数据格式"""
+        max_workers = self.max_workers if max_workers is None else max_workers
         df = self.load_raw_data()
+        cube = self.build_cube(df)
+        del df
         
         # 创建日历和股票池
-        all_dates = self.create_calendar(df)
-        all_instruments = self.create_instruments(df)
+        self.write_calendar(cube.dates)
+        all_instruments = self.write_instruments(cube.instruments)
         
         # 创建features目录
         features_dir = self.output_dir / "features"
         features_dir.mkdir(parents=True, exist_ok=True)
-        
-        # qlib字段映射
-        field_mapping = {
-            'open': 'open',
-            'high': 'high', 
-            'low': 'low',
-            'close': 'close',
-            'vol': 'volume',
-            'amount': 'money'
-        }
+        qlib_fields = [FIELD_MAPPING[f] for f in cube.fields]
         
         print(f"开始转换 {len(all_instruments)} 只ETF数据...")
         
+        if max_workers > 1:
+            self._convert_parallel(cube, features_dir, qlib_fields, max_workers)
+        else:
+            self.save_instrument_batch(features_dir, cube.instruments, cube.values, qlib_fields)
+        
+        print(f"数据转换完成，保存到: {features_dir}")
+        return str(self.output_dir)
+    
+    def _convert_parallel(self, cube, features_dir, qlib_fields, max_workers):
+        """多进程转换: 子进程只接收本批次的立方体切片, 不传递整个数据集"""
+        # 批次数取进程数的数倍, 平衡各进程负载
+        n_instruments = len(cube.instruments)
+        n_batches = min(n_instruments, max_workers * 4)
+        bounds = np.linspace(0, n_instruments, n_batches + 1).astype(int)
+        workers = min(max_workers, os.cpu_count() or 1, n_batches)
+        
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.save_instrument_batch, features_dir,
+                                       list(cube.instruments[a:b]), cube.values[a:b], qlib_fields)
+                       for a, b in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                done += future.result()
+        print(f"并行转换完成: {done} 只ETF, {workers} 个进程")
+    
+    def read_calendar(self):
+        """读取已有日历文件"""
+        calendar_file = self.output_dir / "calendars" / "day.txt"
+        with open(calendar_file, 'r') as f:
+            dates = [line.strip() for line in f if line.strip()]
+        return pd.DatetimeIndex(pd.to_datetime(dates, format='%Y-%m-%d'))
+    
+    def read_instruments(self):
+        """读取已有股票池文件(兼容带起止日期的格式, 只取第一列)"""
+        instruments_file = self.output_dir / "instruments" / "all.txt"
+        with open(instruments_file, 'r') as f:
+            return [line.split()[0] for line in f if line.strip()]
+    
+    def load_new_raw_data(self, last_date):
+        """只加载晚于last_date的原始数据
+        
+        按字节扫描日期列, 只解析新增行和所需的列, 耗时不再随全部历史增长;
+        文件格式无法按字节定位时, 先以int32只读trade_date列找出新增行, 再跳过其余行读取。
+        """
+        last = int(last_date.strftime('%Y%m%d'))
+        header = list(pd.read_csv(self.source_file, nrows=0).columns)
+        usecols = ['ts_code', 'trade_date'] + [f for f in FIELD_MAPPING if f in header]
+        dtype = {'ts_code': str, 'trade_date': np.int32}
+        
+        df = read_rows_after(self.source_file, 'trade_date', last, usecols=usecols, dtype=dtype)
+        if df is None:
+            dates = pd.read_csv(self.source_file, usecols=['trade_date'], dtype={'trade_date': np.int32})
+            # 行号0为表头
+            keep = np.r_[True, dates['trade_date'].to_numpy() > last]
+            df = pd.read_csv(self.source_file, usecols=usecols, dtype=dtype, skiprows=lambda i: not keep[i])
+        print(f"新增原始数据 {len(df)} 行")
+        
+        df['trade_date'] = parse_yyyymmdd(df['trade_date'].to_numpy())
+        df = df.set_index(['ts_code', 'trade_date']).sort_index()
+        
+        return df
+    
+    def update_incremental(self):
+        """增量更新: 只追加晚于现有日历最后一天的数据"""
+        calendar_file = self.output_dir / "calendars" / "day.txt"
+        if not calendar_file.exists():
+            print("未找到已有日历, 执行全量转换")
+            return self.convert_to_qlib_format()
+        
+        old_dates = self.read_calendar()
+        df = self.load_new_raw_data(old_dates[-1])
+        if df.empty:
+            print(f"没有晚于 {old_dates[-1].strftime('%Y-%m-%d')} 的新数据")
+            return str(self.output_dir)
+        
+        # 追加日历
+        new_dates = df.index.get_level_values(1).unique().sort_values()
+        calendar_end = len(old_dates)
+        with open(calendar_file, 'a') as f:
+            for date in new_dates:
+                f.write(f"{date.strftime('%Y-%m-%d')}\n")
+        print(f"日历追加 {len(new_dates)} 个交易日: {calendar_file}")
+        
+        old_instruments = self.read_instruments()
+        cube = self.build_cube(df)
+        known = set(old_instruments)
+        listed = [inst for inst in cube.instruments if inst not in known]
+        
+        features_dir = self.output_dir / "features"
+        empty = np.full((len(new_dates), len(cube.fields)), np.nan, dtype='<f4')
+        
+        # 已有ETF: 各字段bin追加新日期的数据, 无新数据的补NaN
+        for instrument in old_instruments:
+            instrument_dir = features_dir / instrument.lower()
+            block = cube.instrument(instrument) if instrument in cube.instruments else empty
+            
+            for i, csv_field in enumerate(cube.fields):
+                output_file = instrument_dir / f"{FIELD_MAPPING[csv_field]}.day.bin"
+                if output_file.exists():
+                    self.append_feature_bin(block[:, i], output_file, calendar_end)
+                else:
+                    instrument_dir.mkdir(parents=True, exist_ok=True)
+                    self.save_feature_bin(block[:, i], output_file, start_index=calendar_end)
+        
+        # 新上市ETF: 从首个交易日开始新建bin文件
+        for instrument in listed:
+            instrument_dir = features_dir / instrument.lower()
+            instrument_dir.mkdir(parents=True, exist_ok=True)
+            
+            block = cube.instrument(instrument)
+            first = int(np.flatnonzero(~np.isnan(block).all(axis=1))[0])
+            for i, csv_field in enumerate(cube.fields):
+                output_file = instrument_dir / f"{FIELD_MAPPING[csv_field]}.day.bin"
+                self.save_feature_bin(block[first:, i], output_file,
+                                      start_index=calendar_end + first)
+        
+        if listed:
+            self.write_instruments(sorted(known | set(listed)))
+            print(f"新增 {len(listed)} 只ETF")
+        
+        print(f"增量更新完成: {len(cube.instruments)} 只ETF有新数据")
+        return str(self.output_dir)
+    
+    def convert_streaming(self, memory_budget_mb=256):
+        """流式转换: 分块读取原始数据, 按ETF缓冲后写入bin, 峰值内存受memory_budget_mb约束
+        
+        第一遍只读代码和日期两列生成日历与股票池; 第二遍按窄dtype只读所需列,
+        行按ETF路由到缓冲区, 缓冲超出预算时通过memmap把数据写入各bin文件对应位置。
+        """
+        budget = int(memory_budget_mb * 1024 ** 2)
+        header = pd.read_csv(self.source_file, nrows=0).columns
+        csv_fields = [f for f in FIELD_MAPPING if f in header]
+        
+        # 预算一半给读取分块(按每行约128字节估算), 一半给ETF缓冲区
+        chunksize = max(10_000, budget // 2 // 128)
+        buffer_budget = budget // 2
+        
+        # 第一遍: 日历与股票池
+        date_set, instrument_set = set(), set()
+        for chunk in pd.read_csv(self.source_file, usecols=['ts_code', 'trade_date'],
+                                 dtype={'ts_code': str, 'trade_date': np.int32},
+                                 chunksize=chunksize):
+            date_set.update(chunk['trade_date'].unique().tolist())
+            instrument_set.update(chunk['ts_code'].unique().tolist())
+        
+        date_codes = np.array(sorted(date_set), dtype=np.int32)
+        all_dates = pd.DatetimeIndex(pd.to_datetime(date_codes.astype(str), format='%Y%m%d'))
+        self.write_calendar(all_dates)
+        all_instruments = self.write_instruments(sorted(instrument_set))
+        
+        features_dir = self.output_dir / "features"
+        features_dir.mkdir(parents=True, exist_ok=True)
+        print(f"开始流式转换 {len(all_instruments)} 只ETF数据...")
+        
+        # 所有bin先重建为全NaN, 输出目录中已有的旧文件不会残留数据或长度不符
+        empty = np.full(len(all_dates), np.nan, dtype='<f4')
         for instrument in all_instruments:
-            # 创建股票目录
             instrument_dir = features_dir / instrument.lower()
             instrument_dir.mkdir(exist_ok=True)
+            for csv_field in csv_fields:
+                self.save_feature_bin(empty, instrument_dir / f"{FIELD_MAPPING[csv_field]}.day.bin")
+        
+        # 第二遍: 分块路由到各ETF缓冲区, 超出预算即写盘
+        dtype = {'ts_code': str, 'trade_date': np.int32}
+        dtype.update({f: np.float32 for f in csv_fields})
+        buffers, buffered = {}, 0
+        for chunk in pd.read_csv(self.source_file, usecols=['ts_code', 'trade_date'] + csv_fields,
+                                 dtype=dtype, chunksize=chunksize):
+            date_pos = np.searchsorted(date_codes, chunk['trade_date'].to_numpy())
+            values = chunk[csv_fields].to_numpy(dtype='<f4')
+            codes, uniques = pd.factorize(chunk['ts_code'])
+            order = np.argsort(codes, kind='stable')
+            bounds = np.flatnonzero(np.diff(codes[order])) + 1
+            for rows in np.split(order, bounds):
+                buffers.setdefault(uniques[codes[rows[0]]], []).append((date_pos[rows], values[rows]))
+            buffered += date_pos.nbytes + values.nbytes
             
-            # 获取该股票的数据
-            if instrument in df.index.get_level_values(0):
-                instrument_data = df.loc[instrument].reindex(all_dates, fill_value=np.nan)
-                
-                # 保存各个字段的bin文件
-                for csv_field, qlib_field in field_mapping.items():
-                    if csv_field in instrument_data.columns:
-                        output_file = instrument_dir / f"{qlib_field}.day.bin"
-                        self.save_feature_bin(instrument_data[csv_field].values, output_file)
+            if buffered > buffer_budget:
+                self._flush_buffers(features_dir, buffers, len(all_dates), csv_fields)
+                buffers, buffered = {}, 0
+        self._flush_buffers(features_dir, buffers, len(all_dates), csv_fields)
         
         print(f"数据转换完成，保存到: {features_dir}")
         return str(self.output_dir)
     
-    def run(self):
-        """运行转换流程"""
+    def _flush_buffers(self, features_dir, buffers, n_dates, csv_fields):
+        """把缓冲区数据写入bin文件(已预先创建为全NaN)对应的日历位置"""
+        for instrument, parts in buffers.items():
+            instrument_dir = features_dir / instrument.lower()
+            date_pos = np.concatenate([p for p, _ in parts])
+            values = np.concatenate([v for _, v in parts])
+            
+            for i, csv_field in enumerate(csv_fields):
+                output_file = instrument_dir / f"{FIELD_MAPPING[csv_field]}.day.bin"
+                data = np.memmap(output_file, dtype='<f4', mode='r+', offset=4, shape=(n_dates,))
+                data[date_pos] = values[:, i]
+                data.flush()
+                del data
+    
+    def run(self, incremental=False, streaming=False):
+        """运行转换流程, incremental=True 时只追加新交易日, streaming=True 时分块流式转换"""
         if not self.source_file.exists():
             print(f"源文件不存在: {self.source_file}")
             return None
-            
+        
+        if incremental:
+            return self.update_incremental()
+        if streaming:
+            return self.convert_streaming()
         return self.convert_to_qlib_format()
 
 
 if __name__ == "__main__":
-    converter = ETFDataConverter()
-    result = converter.run()
+    converter = ETFDataConverter(compact='--compact' in sys.argv)
+    result = converter.run(incremental='--incremental' in sys.argv,
+                           streaming='--streaming' in sys.argv)
     
     if result:
         print(f"ETF数据转换成功！")
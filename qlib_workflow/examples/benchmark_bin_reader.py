@@ -0,0 +1,62 @@
+"""
+对比 BinFeatureReader 与 D.features 读取原始字段的冷启动耗时
+每种方式在独立子进程中运行, 计时包含import、初始化和首次查询
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+PROVIDER_URI = '/data/data_liy/qlib/etf_data'
+START_TIME = '2023-01-01'
+END_TIME = '2024-12-31'
+
+QLIB_CODE = """
+import qlib
+from qlib.data import D
+qlib.init(provider_uri={uri!r}, region='cn')
+with open({uri!r} + '/instruments/all.txt') as f:
+    instruments = [line.split()[0] for line in f if line.strip()]
+data = D.features(instruments, ['$close'], start_time={start!r}, end_time={end!r})
+print(data.shape)
+"""
+
+READER_CODE = """
+import sys
+sys.path.append({root!r})
+from data.bin_reader import BinFeatureReader
+reader = BinFeatureReader({uri!r})
+data = reader.read_frame('all', '$close', start_time={start!r}, end_time={end!r})
+print(data.shape)
+"""
+
+
+def run_cold(code, repeat=3):
+    """在子进程中运行代码, 返回最短耗时和输出"""
+    best, output = float('inf'), ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        best = min(best, time.perf_counter() - start)
+        output = result.stdout.strip().splitlines()[-1]
+    return best, output
+
+
+def benchmark(provider_uri=PROVIDER_URI):
+    """读取全部ETF的 $close, 比较两种方式"""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    params = dict(uri=provider_uri, root=root, start=START_TIME, end=END_TIME)
+
+    print(f"数据目录: {provider_uri}, 区间: {START_TIME} 到 {END_TIME}")
+    results = {}
+    for name, code in [('D.features', QLIB_CODE), ('BinFeatureReader', READER_CODE)]:
+        seconds, shape = run_cold(code.format(**params))
+        results[name] = seconds
+        print(f"  {name:>16}: {seconds:.3f}s, 结果形状 {shape}")
+    print(f"  加速比: {results['D.features'] / results['BinFeatureReader']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else PROVIDER_URI)
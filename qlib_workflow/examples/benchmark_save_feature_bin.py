@@ -0,0 +1,65 @@
+"""
+对比逐值写入与整列写入bin文件的耗时
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加项目路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from data_converter import ETFDataConverter
+
+
+def save_feature_bin_per_value(data, output_file, start_index=0):
+    """原逐值写入方式(仅用于对比)"""
+    with open(output_file, 'wb') as f:
+        f.write(struct.pack('<f', float(start_index)))
+        for value in data:
+            if pd.isna(value):
+                f.write(struct.pack('<f', float('nan')))
+            else:
+                f.write(struct.pack('<f', float(value)))
+
+
+def benchmark(n_values=5000, n_columns=600, repeat=3):
+    """写出 n_columns 列、每列 n_values 个值, 比较两种写法"""
+    rng = np.random.default_rng(0)
+    columns = rng.normal(10, 1, size=(n_columns, n_values))
+    columns[rng.random(columns.shape) < 0.05] = np.nan
+
+    converter = ETFDataConverter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        results = {}
+        for name, writer in [('per_value', save_feature_bin_per_value),
+                             ('bulk', converter.save_feature_bin)]:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for i, column in enumerate(columns):
+                    writer(column, tmp_dir / f"{name}_{i}.day.bin")
+                best = min(best, time.perf_counter() - start)
+            results[name] = best
+
+        # 校验两种写法输出完全一致
+        for i in range(n_columns):
+            assert (tmp_dir / f"per_value_{i}.day.bin").read_bytes() == \
+                (tmp_dir / f"bulk_{i}.day.bin").read_bytes()
+
+    total = n_values * n_columns
+    print(f"写入 {n_columns} 列 x {n_values} 个值 (共 {total} 个)")
+    for name, seconds in results.items():
+        print(f"  {name:>10}: {seconds:.3f}s ({total / seconds / 1e6:.2f}M 值/秒)")
+    print(f"  加速比: {results['per_value'] / results['bulk']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
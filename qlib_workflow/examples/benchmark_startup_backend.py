@@ -0,0 +1,53 @@
+"""
+对比 PriceStartupIndicator 三种计算后端在全部ETF上的耗时, 并校验结果一致
+qlib: D.features 逐个表达式计算; compiler: 共享子表达式; native: bin矩阵 + numpy滚动算子
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import qlib
+
+# 添加项目路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from data.bin_reader import BinFeatureReader
+from indicators.price_startup_indicator import PriceStartupIndicator
+
+PROVIDER_URI = '/data/data_liy/qlib/etf_data'
+START_TIME = '2023-01-01'
+END_TIME = '2024-12-31'
+
+
+def benchmark(provider_uri=PROVIDER_URI, repeat=3):
+    """在全部ETF上运行三种后端, 输出最短耗时与最大误差"""
+    qlib.init(provider_uri=provider_uri, region='cn')
+    instruments = BinFeatureReader(provider_uri).list_instruments('all')
+    indicator = PriceStartupIndicator()
+
+    print(f"数据目录: {provider_uri}, ETF数量: {len(instruments)}, 区间: {START_TIME} 到 {END_TIME}")
+    results, timings = {}, {}
+    for backend in ['qlib', 'compiler', 'native']:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results[backend] = indicator.analyze_etf_startup(
+                instruments, START_TIME, END_TIME, backend=backend, provider_uri=provider_uri)
+            best = min(best, time.perf_counter() - start)
+        timings[backend] = best
+
+    expected = results['qlib']
+    for backend, seconds in timings.items():
+        data = results[backend]
+        assert data.index.equals(expected.index) and list(data.columns) == list(expected.columns)
+        diff = np.abs(data.to_numpy(np.float64) - expected.to_numpy(np.float64))
+        mismatched = ~np.isclose(data.to_numpy(np.float64), expected.to_numpy(np.float64),
+                                 rtol=1e-5, equal_nan=True)
+        print(f"  {backend:>8}: {seconds:.3f}s, 加速比 {timings['qlib'] / seconds:.1f}x, "
+              f"最大误差 {np.nanmax(diff, initial=0):.2e}, 不一致 {mismatched.sum()} 个")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else PROVIDER_URI)
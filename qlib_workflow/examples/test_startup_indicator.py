@@ -91,18 +91,22 @@ def test_multiple_etfs():
     indicator = PriceStartupIndicator()
     results = {}
     
+    try:
+        # 一次查询全部ETF, 分组汇总
+        _, summary = indicator.analyze_etf_startup_batch(etf_list, start_time, end_time)
+    except Exception as e:
+        print(f"批量分析失败: {e}")
+        return results
+    
     for etf_code, etf_name in zip(etf_list, etf_names):
-        try:
-            data = indicator.analyze_etf_startup([etf_code], start_time, end_time)
-            summary = indicator.get_startup_summary(data)
-            results[etf_name] = summary
-            
-            print(f"\n{etf_name} ({etf_code}):")
-            print(f"  启动信号比例: {summary['startup_ratio']:.2%}")
-            print(f"  平均启动强度: {summary.get('avg_startup_strength', 0):.2f}")
-            
-        except Exception as e:
-            print(f"{etf_name} 分析失败: {e}")
+        if etf_code not in summary.index:
+            print(f"{etf_name} 分析失败: 无数据")
+            continue
+        results[etf_name] = summary.loc[etf_code].to_dict()
+        
+        print(f"\n{etf_name} ({etf_code}):")
+        print(f"  启动信号比例: {summary.loc[etf_code, 'startup_ratio']:.2%}")
+        print(f"  平均启动强度: {summary.loc[etf_code, 'avg_startup_strength']:.2f}")
     
     return results
 
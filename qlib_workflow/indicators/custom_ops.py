@@ -0,0 +1,83 @@
+"""
+自定义qlib算子
+StartupScore: 在每只ETF的原始数组上一次算出五个启动子条件并求和,
+代替五条子表达式各自的算子链和中间Series
+
+使用方式:
+    qlib.init(provider_uri=..., custom_ops=[StartupScore])
+    D.features(instruments, ['StartupScore($close, $high, $volume, 20, 1.05, 0.01, 20, 0.002, 10, 1.03)'])
+已初始化的qlib也可调用 register_custom_ops() 注册
+"""
+
+
+import numpy as np
+import pandas as pd
+from qlib.data.base import ExpressionOps
+
+from . import rolling_kernels
+
+
+def startup_conditions(close, high, volume, volume_ma_period=20, volume_threshold=1.05, price_threshold=0.01,
+                       resistance_period=20, breakout_threshold=0.002, volatility_period=10, volatility_threshold=1.03):
+    """五个启动子条件, 输入为一维序列或 (交易日 x ETF) 矩阵, 语义与对应的qlib表达式一致"""
+    with np.errstate(all='ignore'):
+        prev_close = rolling_kernels.shift(close, 1)
+        volatility = rolling_kernels.rolling_std(close, volatility_period)
+        return [
+            volume / rolling_kernels.rolling_mean(volume, volume_ma_period) > volume_threshold,
+            (close / prev_close - 1) > price_threshold,
+            close > rolling_kernels.rolling_max(high, resistance_period) * (1 + breakout_threshold),
+            volatility > rolling_kernels.rolling_mean(volatility, volatility_period * 2) * volatility_threshold,
+            close > prev_close,
+        ]
+
+
+def startup_score(close, high, volume, *params):
+    """满足的子条件个数(0-5)"""
+    shape = np.shape(close)
+    arrays = [np.asarray(x).reshape(shape[0], -1) for x in (close, high, volume)]
+    score = np.zeros(arrays[0].shape, dtype=np.float32)
+    for condition in startup_conditions(*arrays, *params):
+        score += condition
+    return score.reshape(shape)
+
+
+def startup_window(volume_ma_period=20, volume_threshold=1.05, price_threshold=0.01, resistance_period=20,
+                   breakout_threshold=0.002, volatility_period=10, volatility_threshold=1.03):
+    """需要向前扩展的交易日数: 10日波动率再取20日均值等"""
+    return max(volume_ma_period - 1, resistance_period - 1, volatility_period * 3 - 2, 1)
+
+
+class StartupScore(ExpressionOps):
+    """启动强度评分算子: StartupScore($close, $high, $volume, 各周期与阈值参数)"""
+
+    def __init__(self, close, high, volume, volume_ma_period=20, volume_threshold=1.05, price_threshold=0.01,
+                 resistance_period=20, breakout_threshold=0.002, volatility_period=10, volatility_threshold=1.03):
+        self.features = [close, high, volume]
+        self.params = (volume_ma_period, volume_threshold, price_threshold, resistance_period,
+                       breakout_threshold, volatility_period, volatility_threshold)
+
+    def __str__(self):
+        return "{}({})".format(type(self).__name__, ",".join(str(x) for x in self.features + list(self.params)))
+
+    def _load_internal(self, instrument, start_index, end_index, *args):
+        series = [feature.load(instrument, start_index, end_index, *args) for feature in self.features]
+        index = series[0].index
+        arrays = [s.to_numpy() if s.index.equals(index) else s.reindex(index).to_numpy() for s in series]
+        return pd.Series(startup_score(*arrays, *self.params), index=index)
+
+    def get_longest_back_rolling(self):
+        return max(f.get_longest_back_rolling() for f in self.features) + startup_window(*self.params)
+
+    def get_extended_window_size(self):
+        lft_etd, rght_etd = zip(*(f.get_extended_window_size() for f in self.features))
+        return max(lft_etd) + startup_window(*self.params), max(rght_etd)
+
+
+def register_custom_ops():
+    """向已初始化的qlib注册本模块的算子(重复调用无影响)"""
+    from qlib.data.ops import Operators
+    try:
+        getattr(Operators, StartupScore.__name__)
+    except AttributeError:
+        Operators.register([StartupScore])
@@ -0,0 +1,281 @@
+"""
+qlib表达式的公共子表达式编译器
+把多个表达式字符串解析为共享节点的DAG, 每个不同的子表达式只计算一次;
+计算在 (交易日 x ETF) 宽表上进行, 运算语义与qlib表达式引擎一致
+"""
+
+import ast
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    from ..data.bin_reader import BinFeatureReader
+    from ..data.sharded_fetch import resolve_instruments, sharded_features, span_mask
+except ImportError:
+    # 以qlib_workflow目录为导入根(indicators为顶层包)时
+    from data.bin_reader import BinFeatureReader
+    from data.sharded_fetch import resolve_instruments, sharded_features, span_mask
+from . import rolling_kernels
+from .custom_ops import startup_score, startup_window
+
+
+# 逐元素运算: qlib算子名 -> numpy函数
+ELEMENTWISE_OPS = {
+    'Add': np.add, 'Sub': np.subtract, 'Mul': np.multiply, 'Div': np.divide, 'Power': np.power,
+    'Gt': np.greater, 'Ge': np.greater_equal, 'Lt': np.less, 'Le': np.less_equal,
+    'Eq': np.equal, 'Ne': np.not_equal, 'And': np.bitwise_and, 'Or': np.bitwise_or,
+    'Abs': np.abs, 'Sign': np.sign, 'Log': np.log, 'Not': np.bitwise_not,
+}
+
+# 滚动运算: qlib算子名 -> pandas rolling方法
+ROLLING_OPS = {
+    'Mean': 'mean', 'Sum': 'sum', 'Std': 'std', 'Var': 'var', 'Max': 'max', 'Min': 'min',
+    'Med': 'median', 'Skew': 'skew', 'Kurt': 'kurt', 'Count': 'count',
+}
+
+# 原生后端支持的滚动运算: qlib算子名 -> (交易日 x ETF) 矩阵算子
+NATIVE_ROLLING_OPS = {
+    'Mean': rolling_kernels.rolling_mean, 'Sum': rolling_kernels.rolling_sum,
+    'Std': rolling_kernels.rolling_std, 'Var': rolling_kernels.rolling_var,
+    'Max': rolling_kernels.rolling_max, 'Min': rolling_kernels.rolling_min,
+}
+
+# 自定义融合算子: 算子名 -> (计算函数, 回看长度函数), 前三个参数为字段, 其余为常数参数
+CUSTOM_OPS = {
+    'StartupScore': (startup_score, startup_window),
+}
+
+_BINOPS = {ast.Add: 'Add', ast.Sub: 'Sub', ast.Mult: 'Mul', ast.Div: 'Div', ast.Pow: 'Power',
+           ast.BitAnd: 'And', ast.BitOr: 'Or'}
+_CMPOPS = {ast.Gt: 'Gt', ast.GtE: 'Ge', ast.Lt: 'Lt', ast.LtE: 'Le', ast.Eq: 'Eq', ast.NotEq: 'Ne'}
+# 左侧为常数的比较, qlib经Python反射后等价于交换左右并翻转比较方向
+_REFLECTED = {'Gt': 'Lt', 'Ge': 'Le', 'Lt': 'Gt', 'Le': 'Ge', 'Eq': 'Eq', 'Ne': 'Ne'}
+
+_FEATURE_PREFIX = '__feature_'
+
+
+class Node:
+    """DAG节点: op为 'Feature' 或qlib算子名, args为子节点或常数参数"""
+
+    def __init__(self, op, args, key):
+        self.op = op
+        self.args = args
+        self.key = key
+        self.lookback = self._lookback()
+
+    def _lookback(self):
+        """向前需要的历史长度, 与qlib的 get_extended_window_size 左侧一致"""
+        children = max([a.lookback for a in self.args if isinstance(a, Node)], default=0)
+        if self.op in ROLLING_OPS:
+            return children + self.args[1] - 1
+        if self.op == 'Ref':
+            return children + max(self.args[1], 0)
+        if self.op in CUSTOM_OPS:
+            return children + CUSTOM_OPS[self.op][1](*self.args[3:])
+        return children
+
+    def __repr__(self):
+        return self.key
+
+
+class ExpressionCompiler:
+    """把qlib表达式解析为共享节点的DAG"""
+
+    def __init__(self):
+        self.nodes = {}
+
+    def compile(self, expressions):
+        """编译 {名称: 表达式} 并返回 CompiledExpressions"""
+        outputs = {name: self.parse(expr) for name, expr in expressions.items()}
+        return CompiledExpressions(outputs, list(self.nodes.values()))
+
+    def parse(self, expr):
+        """解析单个表达式, 与qlib相同借助Python语法处理优先级"""
+        source = re.sub(r"\$(\w+)", rf"{_FEATURE_PREFIX}\1", expr.strip())
+        return self._build(ast.parse(source, mode='eval').body)
+
+    def _intern(self, op, args):
+        """相同的子表达式只保留一个节点"""
+        if op == 'Feature':
+            key = f"${args[0]}"
+        else:
+            key = f"{op}({','.join(repr(a) for a in args)})"
+        if key not in self.nodes:
+            self.nodes[key] = Node(op, args, key)
+        return self.nodes[key]
+
+    def _build(self, tree):
+        if isinstance(tree, ast.Constant):
+            return tree.value
+        if isinstance(tree, ast.Name) and tree.id.startswith(_FEATURE_PREFIX):
+            return self._intern('Feature', (tree.id[len(_FEATURE_PREFIX):],))
+        if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.USub):
+            operand = self._build(tree.operand)
+            return -operand if not isinstance(operand, Node) else self._intern('Mul', (operand, -1))
+        if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.Invert):
+            return self._intern('Not', (self._build(tree.operand),))
+        if isinstance(tree, ast.BinOp) and type(tree.op) in _BINOPS:
+            left, right = self._build(tree.left), self._build(tree.right)
+            if not isinstance(left, Node) and not isinstance(right, Node):
+                # 纯常数运算与qlib一样由Python直接求值
+                return eval(compile(ast.Expression(tree), '<const>', 'eval'))
+            return self._intern(_BINOPS[type(tree.op)], (left, right))
+        if isinstance(tree, ast.Compare) and len(tree.ops) == 1 and type(tree.ops[0]) in _CMPOPS:
+            op = _CMPOPS[type(tree.ops[0])]
+            left, right = self._build(tree.left), self._build(tree.comparators[0])
+            if not isinstance(left, Node):
+                left, right, op = right, left, _REFLECTED[op]
+            return self._intern(op, (left, right))
+        if isinstance(tree, ast.Call) and isinstance(tree.func, ast.Name):
+            args = tuple(self._build(arg) for arg in tree.args)
+            op = tree.func.id
+            if op not in ELEMENTWISE_OPS and op not in ROLLING_OPS and op not in CUSTOM_OPS and op != 'Ref':
+                raise NotImplementedError(f"不支持的算子: {op}")
+            return self._intern(op, args)
+        raise ValueError(f"无法解析的表达式片段: {ast.dump(tree)}")
+
+
+class CompiledExpressions:
+    """编译后的表达式集合"""
+
+    def __init__(self, outputs, nodes):
+        self.outputs = outputs
+        # 节点按创建顺序即为拓扑序(子节点先于父节点创建)
+        self.nodes = nodes
+        self.fields = [n.args[0] for n in self.nodes if n.op == 'Feature']
+        self.lookback = max((n.lookback for n in outputs.values() if isinstance(n, Node)), default=0)
+
+    def shared_nodes(self):
+        """被多个父节点或输出引用的子表达式"""
+        refs = {}
+        for node in self.nodes:
+            for arg in node.args:
+                if isinstance(arg, Node):
+                    refs[arg.key] = refs.get(arg.key, 0) + 1
+        for node in self.outputs.values():
+            if isinstance(node, Node):
+                refs[node.key] = refs.get(node.key, 0) + 1
+        return {key: count for key, count in refs.items() if count > 1 and not key.startswith('$')}
+
+    def evaluate(self, raw, native=False):
+        """在宽表上计算全部输出
+
+        Args:
+            raw: {字段名: (交易日 x ETF) 宽表}, 行需为连续的交易日历
+            native: 为True时raw为numpy矩阵, 滚动运算使用 rolling_kernels 中的O(n)算子
+
+        Returns:
+            {输出名称: 宽表}, 与qlib一致转换为float32
+        """
+        evaluate_node = self._evaluate_native if native else self._evaluate_node
+        values = {}
+        with np.errstate(all='ignore'):
+            for node in self.nodes:
+                values[node.key] = evaluate_node(node, values, raw)
+
+        results = {}
+        for name, node in self.outputs.items():
+            result = values[node.key]
+            try:
+                result = result.astype(np.float32)
+            except (ValueError, TypeError):
+                pass
+            results[name] = result
+        return results
+
+    @staticmethod
+    def _evaluate_node(node, values, raw):
+        args = [values[a.key] if isinstance(a, Node) else a for a in node.args]
+        if node.op == 'Feature':
+            return raw[node.args[0]]
+        if node.op == 'Ref':
+            return args[0].shift(args[1])
+        if node.op in ROLLING_OPS:
+            return getattr(args[0].rolling(args[1], min_periods=1), ROLLING_OPS[node.op])()
+        if node.op in CUSTOM_OPS:
+            result = CUSTOM_OPS[node.op][0](*(np.asarray(a) for a in args[:3]), *args[3:])
+            return pd.DataFrame(result, index=args[0].index, columns=args[0].columns)
+        return ELEMENTWISE_OPS[node.op](*args)
+
+    @staticmethod
+    def _evaluate_native(node, values, raw):
+        args = [values[a.key] if isinstance(a, Node) else a for a in node.args]
+        if node.op == 'Feature':
+            return raw[node.args[0]]
+        if node.op == 'Ref':
+            return rolling_kernels.shift(args[0], args[1])
+        if node.op in ROLLING_OPS:
+            if node.op not in NATIVE_ROLLING_OPS:
+                raise NotImplementedError(f"原生后端不支持的算子: {node.op}")
+            return NATIVE_ROLLING_OPS[node.op](args[0], args[1])
+        if node.op in CUSTOM_OPS:
+            return CUSTOM_OPS[node.op][0](*args)
+        return ELEMENTWISE_OPS[node.op](*args)
+
+    def load(self, instruments, start_time, end_time, freq='day', max_workers=1):
+        """用一次D.features读取原始字段(含回看区间), 计算全部输出; max_workers>1 时分片并行读取
+
+        Returns:
+            与 D.features(instruments, 各输出表达式) 相同行索引和顺序的DataFrame
+        """
+        from qlib.config import C
+        from qlib.data import D
+
+        # 与qlib一致: 原始字段不受上市区间限制, 只在输出时按区间筛选行
+        instruments = resolve_instruments(instruments, C.dpm.get_data_uri(freq), freq)
+        codes = sorted(instruments)
+        calendar = D.calendar(freq=freq)
+        start = calendar.searchsorted(pd.Timestamp(start_time))
+        query_start = calendar[max(0, start - self.lookback)]
+        dates = pd.DatetimeIndex(D.calendar(start_time=query_start, end_time=end_time, freq=freq))
+
+        raw_fields = [f"${f}" for f in self.fields]
+        if max_workers > 1:
+            raw, _ = sharded_features(codes, raw_fields, query_start, end_time, freq, max_workers=max_workers)
+        else:
+            raw = D.features(codes, raw_fields, start_time=query_start, end_time=end_time, freq=freq)
+        raw.columns = self.fields
+        wide = {f: raw[f].unstack(level=0).reindex(dates) for f in self.fields}
+        results = self.evaluate(wide)
+
+        # 按原始查询的行(ETF, 日期)取回结果, 再截取目标区间
+        row_dates = raw.index.get_level_values('datetime')
+        keep = (row_dates >= pd.Timestamp(start_time)) & span_mask(instruments, raw.index)
+        inst_pos = wide[self.fields[0]].columns.get_indexer(raw.index.get_level_values('instrument')[keep])
+        date_pos = dates.get_indexer(row_dates[keep])
+        data = {name: np.asarray(results[name])[date_pos, inst_pos] for name in self.outputs}
+        return pd.DataFrame(data, index=raw.index[keep])
+
+    def load_native(self, instruments, start_time, end_time, provider_uri, freq='day'):
+        """直接从bin文件读取原始字段矩阵并用原生后端计算, 不经过qlib
+
+        Returns:
+            与 load 相同结构的DataFrame: 每只ETF保留其bin文件覆盖且在上市区间内的交易日
+        """
+        reader = BinFeatureReader(provider_uri, freq)
+        spans = resolve_instruments(instruments, provider_uri, freq)
+        instruments = sorted(spans)
+        start, end = reader.locate(start_time, end_time)
+        query_start = max(0, start - self.lookback)
+
+        raw = {}
+        covered = np.zeros((end - query_start, len(instruments)), dtype=bool)
+        for field in self.fields:
+            raw[field], _ = reader.read_matrix(instruments, field, reader.calendar[query_start], end_time)
+            for j, instrument in enumerate(instruments):
+                start_index, data = reader.open(instrument, field)
+                if data is not None:
+                    covered[max(start_index - query_start, 0):max(start_index + len(data) - query_start, 0), j] = True
+        results = self.evaluate(raw, native=True)
+
+        # 按(ETF, 日期)顺序取出目标区间内有数据的位置
+        date_pos, inst_pos = np.nonzero(covered[start - query_start:].T)[::-1]
+        date_pos += start - query_start
+        index = pd.MultiIndex.from_arrays(
+            [np.asarray(instruments)[inst_pos], reader.calendar[query_start + date_pos]],
+            names=['instrument', 'datetime'])
+        keep = span_mask(spans, index)
+        data = {name: np.asarray(results[name])[date_pos[keep], inst_pos[keep]] for name in self.outputs}
+        return pd.DataFrame(data, index=index[keep])
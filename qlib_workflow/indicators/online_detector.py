@@ -0,0 +1,272 @@
+"""
+在线ETF启动信号检测
+逐根K线更新每只ETF的滚动状态(每只ETF只保存窗口长度的数据), 单根K线O(1)均摊,
+输出与 PriceStartupIndicator 表达式版本相同的五个子信号、综合信号和强度评分
+"""
+
+import copy
+import math
+import pickle
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+try:
+    from ..data.bin_reader import BinFeatureReader
+except ImportError:
+    # 以qlib_workflow目录为导入根(indicators为顶层包)时
+    from data.bin_reader import BinFeatureReader
+
+SIGNAL_COLUMNS = ['volume_surge', 'price_momentum', 'resistance_breakout', 'volatility_expansion',
+                  'price_trend', 'startup_signal', 'startup_strength']
+
+
+def _is_nan(value):
+    return value != value
+
+
+class RollingMean:
+    """滚动均值: Kahan补偿的累加/移除, 与pandas rolling(min_periods=1).mean() 一致"""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.total = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.same_count = 0
+        self.prev_value = math.nan
+
+    def push(self, value):
+        """加入新值(可为NaN), 返回当前窗口均值"""
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+        self._add(value)
+        if self.nobs == 0:
+            return math.nan
+        # 窗口内全是同一个值时pandas直接返回该值
+        if self.same_count >= self.nobs:
+            return self.prev_value
+        return self.total / self.nobs
+
+    def _add(self, value):
+        if _is_nan(value):
+            return
+        self.nobs += 1
+        y = value - self.compensation_add
+        t = self.total + y
+        self.compensation_add = t - self.total - y
+        self.total = t
+        if value == self.prev_value:
+            self.same_count += 1
+        else:
+            self.same_count = 1
+            self.prev_value = value
+
+    def _remove(self, value):
+        if _is_nan(value):
+            return
+        self.nobs -= 1
+        y = -value - self.compensation_remove
+        t = self.total + y
+        self.compensation_remove = t - self.total - y
+        self.total = t
+
+
+class RollingStd:
+    """滚动标准差(ddof=1): Welford累加/移除, 与pandas rolling(min_periods=1).std() 一致"""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.mean = 0.0
+        self.ssqdm = 0.0
+        self.same_count = 0
+        self.prev_value = math.nan
+
+    def push(self, value):
+        """加入新值(可为NaN), 返回当前窗口标准差"""
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+        self._add(value)
+        if self.nobs <= 1:
+            return math.nan
+        if self.same_count >= self.nobs:
+            return 0.0
+        return math.sqrt(max(self.ssqdm / (self.nobs - 1), 0.0))
+
+    def _add(self, value):
+        if _is_nan(value):
+            return
+        self.nobs += 1
+        delta = value - self.mean
+        self.mean += delta / self.nobs
+        self.ssqdm += delta * (value - self.mean)
+        if value == self.prev_value:
+            self.same_count += 1
+        else:
+            self.same_count = 1
+            self.prev_value = value
+
+    def _remove(self, value):
+        if _is_nan(value):
+            return
+        self.nobs -= 1
+        if self.nobs == 0:
+            self.mean = self.ssqdm = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.nobs
+        self.ssqdm -= delta * (value - self.mean)
+
+
+class RollingMax:
+    """滚动最大值: 单调递减队列, 队列中保存 (位置, 值)"""
+
+    def __init__(self, window):
+        self.window = window
+        self.queue = deque()
+        self.position = -1
+
+    def push(self, value):
+        """加入新值(可为NaN), 返回当前窗口最大值"""
+        self.position += 1
+        if not _is_nan(value):
+            while self.queue and self.queue[-1][1] <= value:
+                self.queue.pop()
+            self.queue.append((self.position, value))
+        while self.queue and self.queue[0][0] <= self.position - self.window:
+            self.queue.popleft()
+        return self.queue[0][1] if self.queue else math.nan
+
+
+class EtfState:
+    """单只ETF的滚动状态"""
+
+    def __init__(self, volume_ma_period, resistance_period, volatility_period):
+        self.volume_mean = RollingMean(volume_ma_period)
+        self.high_max = RollingMax(resistance_period)
+        self.close_std = RollingStd(volatility_period)
+        self.std_mean = RollingMean(volatility_period * 2)
+        self.prev_close = np.float32(np.nan)
+        self.last_date = None
+
+
+class OnlineStartupDetector:
+    """逐根K线更新的启动信号检测器"""
+
+    def __init__(self, indicator=None):
+        """参数取自 PriceStartupIndicator 实例, 默认使用其默认参数"""
+        if indicator is None:
+            from .price_startup_indicator import PriceStartupIndicator
+            indicator = PriceStartupIndicator()
+        self.volume_ma_period = indicator.volume_ma_period
+        self.volume_threshold = indicator.volume_threshold
+        self.price_threshold = indicator.price_threshold
+        self.resistance_period = indicator.resistance_period
+        self.breakout_threshold = indicator.breakout_threshold
+        self.volatility_period = indicator.volatility_period
+        self.volatility_threshold = indicator.volatility_threshold
+        self.states = {}
+
+    @property
+    def lookback(self):
+        """预热所需的K线数: 波动率均值需要 3*周期-1 根"""
+        return max(self.volume_ma_period, self.resistance_period, self.volatility_period * 3 - 1)
+
+    def update(self, instrument, close, high, volume, date=None):
+        """处理一只ETF的一根K线, 返回信号字典; 停牌日可传入NaN以保持与日历对齐"""
+        state = self.states.get(instrument)
+        if state is None:
+            state = self.states[instrument] = EtfState(
+                self.volume_ma_period, self.resistance_period, self.volatility_period)
+
+        # 与qlib一致, 原始字段为float32, 滚动结果为float64
+        close, high, volume = np.float32(close), np.float32(high), np.float32(volume)
+        volume_mean = state.volume_mean.push(float(volume))
+        high_max = state.high_max.push(float(high))
+        close_std = state.close_std.push(float(close))
+        std_mean = state.std_mean.push(close_std)
+        prev_close, state.prev_close = state.prev_close, close
+        if date is not None:
+            state.last_date = pd.Timestamp(date)
+
+        with np.errstate(all='ignore'):
+            signals = [
+                np.float64(volume) / volume_mean > self.volume_threshold,
+                (close / prev_close - 1) > self.price_threshold,
+                close > high_max * (1 + self.breakout_threshold),
+                close_std > std_mean * self.volatility_threshold,
+                close > prev_close,
+            ]
+        # 与表达式版本一致: qlib中布尔信号相加按逻辑或计算
+        strength = float(any(signals))
+        return dict(zip(SIGNAL_COLUMNS, [float(s) for s in signals] + [float(strength >= 3), strength]))
+
+    def update_bars(self, bars, date=None):
+        """处理一个时点的多只ETF K线
+
+        Args:
+            bars: 以ETF代码为索引, 含 close/high/volume 列的DataFrame
+            date: K线日期
+
+        Returns:
+            以ETF代码为索引的信号DataFrame
+        """
+        rows = {instrument: self.update(instrument, row.close, row.high, row.volume, date)
+                for instrument, row in zip(bars.index, bars[['close', 'high', 'volume']].itertuples())}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=SIGNAL_COLUMNS)
+
+    def warm_start(self, provider_uri, instruments='all', end_time=None):
+        """从转换后的bin文件读取最近 lookback 根K线预热状态
+
+        Returns:
+            预热最后一天的信号DataFrame
+        """
+        reader = BinFeatureReader(provider_uri)
+        if isinstance(instruments, str):
+            instruments = reader.list_instruments(instruments)
+        _, end = reader.locate(None, end_time)
+        start_time = reader.calendar[max(0, end - self.lookback)]
+        end_time = reader.calendar[end - 1]
+        matrices = {field: reader.read_matrix(instruments, field, start_time, end_time)[0]
+                    for field in ['close', 'high', 'volume']}
+        dates = reader.calendar[max(0, end - self.lookback):end]
+
+        for instrument in instruments:
+            self.states.pop(instrument, None)
+        signals = None
+        for i, date in enumerate(dates):
+            bars = pd.DataFrame({field: matrices[field][i] for field in matrices}, index=instruments)
+            signals = self.update_bars(bars, date)
+        print(f"预热完成: {len(instruments)} 只ETF, {len(dates)} 个交易日, 截至 {end_time.date()}")
+        return signals
+
+    def snapshot(self):
+        """导出可序列化的状态"""
+        return {'params': {name: value for name, value in vars(self).items() if name != 'states'},
+                'states': copy.deepcopy(self.states)}
+
+    @classmethod
+    def restore(cls, snapshot):
+        """由 snapshot 恢复检测器"""
+        detector = cls.__new__(cls)
+        vars(detector).update(snapshot['params'])
+        detector.states = copy.deepcopy(snapshot['states'])
+        return detector
+
+    def save(self, path):
+        """保存状态到文件"""
+        with open(path, 'wb') as f:
+            pickle.dump(self.snapshot(), f)
+
+    @classmethod
+    def load(cls, path):
+        """从文件恢复检测器"""
+        with open(path, 'rb') as f:
+            return cls.restore(pickle.load(f))
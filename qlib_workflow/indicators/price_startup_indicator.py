@@ -8,6 +8,17 @@ from qlib.data import D
 import pandas as pd
 import numpy as np
 
+try:
+    from ..data.bin_reader import BinFeatureReader
+    from ..data.sharded_fetch import resolve_instruments, sharded_features
+except ImportError:
+    # 以qlib_workflow目录为导入根(indicators为顶层包)时
+    from data.bin_reader import BinFeatureReader
+    from data.sharded_fetch import resolve_instruments, sharded_features
+from . import threshold_sweep
+from .custom_ops import StartupScore, register_custom_ops
+from .expression_compiler import ExpressionCompiler
+
 
 class PriceStartupIndicator:
     """ETF价格突然启动检测指标"""
@@ -29,6 +40,9 @@ class PriceStartupIndicator:
         # 波动率参数
         self.volatility_period = 10  # 波动率计算周期
         self.volatility_threshold = 1.03  # 波动率放大倍数
+        
+        # 为True时强度评分使用融合算子 StartupScore, 一次计算五个子条件并按个数求和
+        self.use_fused_score = False
     
         
     def get_volume_surge_signal(self):
@@ -53,6 +67,9 @@ class PriceStartupIndicator:
     
     def get_comprehensive_startup_signal(self):
         """综合启动信号 - 组合多个子信号"""
+        if self.use_fused_score:
+            return f"({self.get_fused_startup_score()} >= 3)"
+        
         volume_signal = self.get_volume_surge_signal()
         momentum_signal = self.get_price_momentum_signal()
         breakout_signal = self.get_resistance_breakout_signal()
@@ -62,8 +79,17 @@ class PriceStartupIndicator:
         # 综合信号：至少满足3个条件
         return f"({volume_signal} + {momentum_signal} + {breakout_signal} + {volatility_signal} + {trend_signal}) >= 3"
     
+    def get_fused_startup_score(self):
+        """融合算子版本的启动强度评分"""
+        return (f"StartupScore($close, $high, $volume, {self.volume_ma_period}, {self.volume_threshold}, "
+                f"{self.price_threshold}, {self.resistance_period}, {self.breakout_threshold}, "
+                f"{self.volatility_period}, {self.volatility_threshold})")
+    
     def get_startup_strength_score(self):
         """启动强度评分 - 返回0-5的评分"""
+        if self.use_fused_score:
+            return self.get_fused_startup_score()
+        
         volume_signal = self.get_volume_surge_signal()
         momentum_signal = self.get_price_momentum_signal()
         breakout_signal = self.get_resistance_breakout_signal()
@@ -84,12 +110,18 @@ class PriceStartupIndicator:
             'startup_strength': self.get_startup_strength_score()
         }
     
-    def analyze_etf_startup(self, instruments, start_time, end_time):
-        """分析ETF启动信号"""
+    @staticmethod
+    def _provider_uri(provider_uri=None):
+        """未指定数据目录时取qlib当前配置"""
+        if provider_uri is None:
+            from qlib.config import C
+            provider_uri = C.dpm.get_data_uri('day')
+        return provider_uri
+    
+    def get_query_fields(self):
+        """analyze_etf_startup 查询的字段表达式"""
         signals = self.get_all_signals()
-        
-        # 构建查询字段
-        fields = [
+        return [
             '$close', '$open', '$high', '$low', '$volume',
             signals['volume_surge'],
             signals['price_momentum'], 
@@ -99,14 +131,52 @@ class PriceStartupIndicator:
             signals['comprehensive_signal'],
             signals['startup_strength']
         ]
+    
+    def get_lookback(self):
+        """全部信号表达式需要的最长回看交易日数(如10日波动率再取20日均值需要向前28个交易日)"""
+        return self.compile_fields(self.get_query_fields()).lookback
+    
+    def compile_fields(self, fields):
+        """把查询字段编译为共享子表达式的DAG"""
+        return ExpressionCompiler().compile({i: field for i, field in enumerate(fields)})
+    
+    def analyze_etf_startup(self, instruments, start_time, end_time, backend='compiler', provider_uri=None,
+                            max_workers=1):
+        """分析ETF启动信号
+        
+        backend:
+            'compiler' 只查询一次原始字段, 各子表达式只计算一次, 综合信号直接由已算出的子信号组合;
+            'native' 直接读取bin文件为 (交易日 x ETF) 矩阵, 用numpy滚动算子计算, 不经过qlib表达式引擎,
+                provider_uri 默认取qlib当前配置的数据目录;
+            'qlib' 逐个表达式交给 D.features 计算。
+        max_workers: 大于1时 'compiler'/'qlib' 后端按ETF分片在进程池中并行查询
+        """
+        # 构建查询字段
+        fields = self.get_query_fields()
         
         # 获取数据
-        data = D.features(
-            instruments=instruments,
-            fields=fields,
-            start_time=start_time,
-            end_time=end_time
-        )
+        if backend == 'compiler':
+            data = self.compile_fields(fields).load(instruments, start_time, end_time, max_workers=max_workers)
+            data.columns = fields
+        elif backend == 'native':
+            data = self.compile_fields(fields).load_native(instruments, start_time, end_time,
+                                                           self._provider_uri(provider_uri))
+            data.columns = fields
+        elif backend == 'qlib':
+            if self.use_fused_score:
+                register_custom_ops()
+            if max_workers > 1:
+                data, _ = sharded_features(instruments, fields, start_time, end_time, max_workers=max_workers,
+                                           custom_ops=[StartupScore] if self.use_fused_score else None)
+            else:
+                data = D.features(
+                    instruments=instruments,
+                    fields=fields,
+                    start_time=start_time,
+                    end_time=end_time
+                )
+        else:
+            raise ValueError(f"未知的计算后端: {backend}")
         
         # 重命名列以便理解
         if len(data.columns) >= 12:
@@ -119,6 +189,47 @@ class PriceStartupIndicator:
         
         return data
     
+    def screen_startup(self, instruments='all', end_time=None, n_bars=1, backend='native',
+                       provider_uri=None, only_fired=False):
+        """每日筛选: 只计算截至 end_time 的最近 n_bars 个交易日
+        
+        各后端都只加载 get_lookback() 个交易日的预热数据加目标交易日, 耗时与历史长度无关。
+        
+        Returns:
+            目标交易日的信号数据, only_fired=True 时只保留 startup_signal 触发的行
+        """
+        reader = BinFeatureReader(self._provider_uri(provider_uri))
+        _, end = reader.locate(None, end_time)
+        target_dates = reader.calendar[max(0, end - n_bars):end]
+        
+        instruments = resolve_instruments(instruments, self._provider_uri(provider_uri))
+        if isinstance(instruments, dict):
+            # 只评估目标交易日处于上市区间内的ETF
+            instruments = {code: spans for code, spans in instruments.items()
+                           if spans is None or any(listed <= target_dates[-1] and delisted >= target_dates[0]
+                                                   for listed, delisted in spans)}
+        
+        data = self.analyze_etf_startup(instruments, target_dates[0], target_dates[-1],
+                                        backend=backend, provider_uri=provider_uri)
+        fired = data['startup_signal'] == 1
+        print(f"筛选 {target_dates[0].date()} 到 {target_dates[-1].date()}: {len(instruments)} 只ETF, "
+              f"预热 {self.get_lookback()} 个交易日, 触发 {int(fired.sum())} 次")
+        return data[fired] if only_fired else data
+    
+    def sweep_thresholds(self, instruments, start_time, end_time, thresholds=None, windows=None,
+                         horizon=5, min_conditions=3, max_workers=None, provider_uri=None):
+        """阈值参数扫描
+        
+        thresholds/windows 为 {参数名: 取值列表}, 未给出的参数取当前设置;
+        综合信号按满足的条件个数 >= min_conditions 计算, 返回每个组合的信号频率与 horizon 日未来收益统计。
+        """
+        thresholds = {name: (thresholds or {}).get(name, [getattr(self, name)])
+                      for name in threshold_sweep.THRESHOLD_PARAMS}
+        windows = {name: (windows or {}).get(name, [getattr(self, name)])
+                   for name in threshold_sweep.WINDOW_PARAMS}
+        return threshold_sweep.sweep_thresholds(self._provider_uri(provider_uri), instruments, start_time, end_time,
+                                                windows, thresholds, horizon, min_conditions, max_workers)
+    
     def get_startup_summary(self, data):
         """获取启动信号汇总统计"""
         startup_days = data[data['startup_signal'] == 1]
@@ -145,6 +256,46 @@ class PriceStartupIndicator:
         return summary
 
 
+    def analyze_etf_startup_batch(self, instruments, start_time, end_time, backend='compiler', provider_uri=None):
+        """批量分析多只ETF: 一次查询全部ETF, 再一次分组聚合得到每只ETF的汇总
+        
+        instruments 可以是代码列表、股票池名称(如 'etf_human')或 D.instruments() 配置,
+        股票池展开为 {代码: 上市区间}, 只统计上市区间内的交易日(与 D.features(D.instruments(market)) 一致)。
+        
+        Returns:
+            (data, summary): data 同 analyze_etf_startup, summary 以ETF代码为索引
+        """
+        instruments = resolve_instruments(instruments, self._provider_uri(provider_uri))
+        data = self.analyze_etf_startup(instruments, start_time, end_time, backend=backend, provider_uri=provider_uri)
+        return data, self.get_startup_summary_batch(data)
+    
+    def get_startup_summary_batch(self, data):
+        """按ETF分组的启动信号汇总, 指标与 get_startup_summary 相同"""
+        rate_columns = {
+            'volume_surge': 'volume_surge_rate',
+            'price_momentum': 'momentum_rate',
+            'resistance_breakout': 'breakout_rate',
+            'volatility_expansion': 'volatility_rate',
+            'price_trend': 'trend_rate'
+        }
+        startup = data['startup_signal'] == 1
+        # 非启动日置为NaN, 分组均值/最大值即只统计启动日
+        frame = data[['startup_strength', *rate_columns]].where(startup, axis=0)
+        frame['startup'] = startup
+        
+        summary = frame.groupby(level='instrument', sort=False).agg(
+            total_days=('startup', 'size'),
+            startup_days=('startup', 'sum'),
+            avg_startup_strength=('startup_strength', 'mean'),
+            max_startup_strength=('startup_strength', 'max'),
+            **{rate: (column, 'mean') for column, rate in rate_columns.items()}
+        )
+        summary.insert(2, 'startup_ratio', summary['startup_days'] / summary['total_days'])
+        summary[['avg_startup_strength', 'max_startup_strength']] = \
+            summary[['avg_startup_strength', 'max_startup_strength']].fillna(0)
+        return summary
+
+
 def create_startup_fields():
     """创建用于qlib的启动信号字段表达式"""
     indicator = PriceStartupIndicator()
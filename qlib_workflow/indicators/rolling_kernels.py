@@ -0,0 +1,110 @@
+"""
+(交易日 x ETF) 矩阵上的滚动窗口算子
+沿第0轴计算, 语义与pandas的 rolling(window, min_periods=1) 一致: NaN不计入窗口观测数,
+窗口内没有观测时结果为NaN; 每个算子对序列长度都是O(n), 与窗口大小无关
+"""
+
+import numpy as np
+
+
+def _sliding(x, window, accumulate, fill):
+    """分块前缀/后缀累积(van Herk/Gil-Werman), 返回每个窗口的两段部分结果
+
+    窗口 [i-window+1, i] 被块边界分成两段: 左段为所在块的后缀累积,
+    右段为下一块的前缀累积; 窗口恰好与块对齐时右段为空, 返回fill。
+    """
+    n, cols = x.shape
+    blocks = (n + 2 * (window - 1)) // window + 1
+    padded = np.full((blocks * window, cols), fill, dtype=x.dtype)
+    padded[window - 1:window - 1 + n] = x
+    padded = padded.reshape(blocks, window, cols)
+
+    prefix = accumulate(padded, axis=1).reshape(-1, cols)
+    suffix = accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape(-1, cols)
+
+    left = suffix[:n]
+    right = prefix[window - 1:window - 1 + n].copy()
+    right[np.arange(n) % window == 0] = fill
+    return left, right
+
+
+def rolling_sum_count(x, window):
+    """窗口内非NaN值之和与观测数"""
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    left, right = _sliding(np.where(valid, x, 0.0), window, np.add.accumulate, 0.0)
+    count_left, count_right = _sliding(valid.astype(np.int64), window, np.add.accumulate, 0)
+    return left + right, count_left + count_right
+
+
+def rolling_max(x, window):
+    """滚动最大值"""
+    x = np.asarray(x, dtype=np.float64)
+    left, right = _sliding(np.where(np.isnan(x), -np.inf, x), window, np.maximum.accumulate, -np.inf)
+    result = np.maximum(left, right)
+    result[result == -np.inf] = np.nan
+    return result
+
+
+def rolling_min(x, window):
+    """滚动最小值"""
+    return -rolling_max(-np.asarray(x, dtype=np.float64), window)
+
+
+def _constant_windows(x, window):
+    """窗口内全部观测相同的位置及该值; pandas对这类窗口返回精确值"""
+    high, low = rolling_max(x, window), rolling_min(x, window)
+    return high == low, high
+
+
+def rolling_sum(x, window):
+    """滚动求和"""
+    total, count = rolling_sum_count(x, window)
+    total[count == 0] = np.nan
+    return total
+
+
+def rolling_mean(x, window):
+    """滚动均值"""
+    total, count = rolling_sum_count(x, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = total / count
+    constant, value = _constant_windows(x, window)
+    result[constant] = value[constant]
+    return result
+
+
+def rolling_var(x, window, ddof=1):
+    """滚动方差, 观测数不超过ddof时为NaN"""
+    x = np.asarray(x, dtype=np.float64)
+    # 先减去列均值, 降低平方和相减时的精度损失
+    observed = np.maximum((~np.isnan(x)).sum(axis=0), 1)
+    centered = x - np.nansum(x, axis=0) / observed
+    total, count = rolling_sum_count(centered, window)
+    squares, _ = rolling_sum_count(centered * centered, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.maximum(squares - total * total / count, 0.0) / (count - ddof)
+    result[count <= ddof] = np.nan
+    constant, _ = _constant_windows(x, window)
+    result[constant & (count > ddof)] = 0.0
+    return result
+
+
+def rolling_std(x, window, ddof=1):
+    """滚动标准差"""
+    return np.sqrt(rolling_var(x, window, ddof))
+
+
+def shift(x, periods):
+    """沿时间轴平移, 移出部分为NaN"""
+    x = np.asarray(x)
+    if x.dtype.kind not in 'fc':
+        x = x.astype(np.float64)
+    result = np.full_like(x, np.nan)
+    if periods > 0:
+        result[periods:] = x[:-periods]
+    elif periods < 0:
+        result[:periods] = x[-periods:]
+    else:
+        result[:] = x
+    return result
@@ -0,0 +1,174 @@
+"""
+PriceStartupIndicator 阈值参数扫描
+每组窗口参数只计算一次比率特征(成交量比、涨幅、突破比、波动率比),
+阈值网格以广播比较一次性求值; 不同窗口参数在进程池中并行,
+返回每个参数组合的信号频率与未来收益统计表
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    from ..data.bin_reader import BinFeatureReader
+except ImportError:
+    # 以qlib_workflow目录为导入根(indicators为顶层包)时
+    from data.bin_reader import BinFeatureReader
+from . import rolling_kernels
+
+WINDOW_PARAMS = ['volume_ma_period', 'resistance_period', 'volatility_period']
+THRESHOLD_PARAMS = ['volume_threshold', 'price_threshold', 'breakout_threshold', 'volatility_threshold']
+
+
+def compute_ratio_features(close, high, volume, volume_ma_period, resistance_period, volatility_period):
+    """计算与阈值无关的比率特征, 输入输出均为 (交易日 x ETF) 矩阵"""
+    with np.errstate(all='ignore'):
+        prev_close = rolling_kernels.shift(close, 1)
+        volatility = rolling_kernels.rolling_std(close, volatility_period)
+        return {
+            'volume_ratio': volume / rolling_kernels.rolling_mean(volume, volume_ma_period),
+            'price_change': close / prev_close - 1,
+            'breakout_ratio': close / rolling_kernels.rolling_max(high, resistance_period),
+            'volatility_ratio': volatility / rolling_kernels.rolling_mean(volatility, volatility_period * 2),
+            'price_trend': close > prev_close,
+        }
+
+
+def evaluate_threshold_grid(features, forward_return, valid, thresholds, min_conditions=3,
+                            chunk_elements=1 << 23):
+    """对阈值网格广播求值
+
+    Args:
+        features: compute_ratio_features 的结果(已截取到评估区间)
+        forward_return: 未来收益矩阵, 无法计算处为NaN
+        valid: 参与统计的位置(当日有收盘价)
+        thresholds: {阈值参数名: 取值列表}, 键为 THRESHOLD_PARAMS
+        min_conditions: 至少满足的条件个数
+        chunk_elements: 按交易日分块, 每块广播结果的元素数上限
+
+    Returns:
+        DataFrame, 每行一个阈值组合
+    """
+    grids = [np.asarray(thresholds[name], dtype=np.float64) for name in THRESHOLD_PARAMS]
+    n_dates, n_instruments = valid.shape
+    n_others = len(grids[1]) * len(grids[2]) * len(grids[3])
+    chunk = max(1, chunk_elements // max(n_others * n_instruments, 1))
+
+    has_return = valid & np.isfinite(forward_return)
+    returns = np.where(has_return, forward_return, 0.0)
+    positive = returns > 0
+
+    # 每个(成交量阈值, 其余阈值组合)的 信号数、有收益的信号数、正收益的信号数 与 收益和
+    counts = np.zeros((len(grids[0]), n_others, 3), dtype=np.int64)
+    return_sum = np.zeros((len(grids[0]), n_others))
+    for lo in range(0, n_dates, chunk):
+        rows = slice(lo, lo + chunk)
+        # 涨幅、突破、波动率条件各占一个广播维度: (涨幅阈值 x 突破阈值 x 波动率阈值 x 交易日 x ETF)
+        others = (
+            (features['price_change'][rows] > grids[1][:, None, None, None, None]).astype(np.int8)
+            + (features['breakout_ratio'][rows] > 1 + grids[2][None, :, None, None, None])
+            + (features['volatility_ratio'][rows] > grids[3][None, None, :, None, None])
+            + features['price_trend'][rows]
+        ).reshape(n_others, -1)
+        volume_ratio = features['volume_ratio'][rows].ravel()
+        mask, chunk_has_return = valid[rows].ravel(), has_return[rows].ravel()
+        chunk_returns, chunk_positive = returns[rows].ravel(), positive[rows].ravel()
+
+        for i, volume_threshold in enumerate(grids[0]):
+            signal = (others + (volume_ratio > volume_threshold)) >= min_conditions
+            signal &= mask
+            counts[i, :, 0] += np.count_nonzero(signal, axis=1)
+            counts[i, :, 1] += np.count_nonzero(signal & chunk_has_return, axis=1)
+            counts[i, :, 2] += np.count_nonzero(signal & chunk_positive, axis=1)
+            return_sum[i] += signal.astype(np.float64) @ chunk_returns
+
+    rows = []
+    for i, volume_threshold in enumerate(grids[0]):
+        for k, combo in enumerate(itertools.product(*grids[1:])):
+            rows.append((volume_threshold, *combo, *counts[i, k], return_sum[i, k]))
+
+    result = pd.DataFrame(rows, columns=THRESHOLD_PARAMS + ['signal_count', 'return_count',
+                                                            'positive_count', 'return_sum'])
+    with np.errstate(all='ignore'):
+        result['signal_freq'] = result['signal_count'] / max(valid.sum(), 1)
+        result['mean_forward_return'] = result['return_sum'] / result['return_count']
+        result['hit_rate'] = result['positive_count'] / result['return_count']
+        result['excess_return'] = result['mean_forward_return'] - returns.sum() / max(has_return.sum(), 1)
+    result['signal_count'] = result['signal_count'].astype(np.int64)
+    return result.drop(columns=['return_count', 'return_sum', 'positive_count'])
+
+
+# 子进程中的原始字段矩阵, 由进程池initializer设置一次, 各任务不再重复序列化
+_WORKER_MATRICES = None
+
+
+def _init_sweep_worker(matrices):
+    """进程池initializer: 保存原始字段矩阵"""
+    global _WORKER_MATRICES
+    _WORKER_MATRICES = matrices
+
+
+def _sweep_window_setting(setting, thresholds, offset, length, horizon, min_conditions, matrices=None):
+    """子进程任务: 计算一组窗口参数的特征并评估整个阈值网格"""
+    matrices = _WORKER_MATRICES if matrices is None else matrices
+    close, high, volume = matrices['close'], matrices['high'], matrices['volume']
+    features = compute_ratio_features(close, high, volume, **setting)
+    features = {name: values[offset:offset + length] for name, values in features.items()}
+    with np.errstate(all='ignore'):
+        forward_return = rolling_kernels.shift(close, -horizon) / close - 1
+    forward_return = forward_return[offset:offset + length]
+    valid = ~np.isnan(close[offset:offset + length])
+
+    result = evaluate_threshold_grid(features, forward_return, valid, thresholds, min_conditions)
+    for name in reversed(WINDOW_PARAMS):
+        result.insert(0, name, setting[name])
+    return result
+
+
+def sweep_thresholds(provider_uri, instruments, start_time, end_time, windows, thresholds,
+                     horizon=5, min_conditions=3, max_workers=None):
+    """扫描窗口参数与阈值参数的全部组合
+
+    Args:
+        provider_uri: qlib数据目录, 原始字段直接从bin文件读取
+        instruments: ETF代码列表或股票池名称
+        windows: {窗口参数名: 取值列表}, 键为 WINDOW_PARAMS
+        thresholds: {阈值参数名: 取值列表}, 键为 THRESHOLD_PARAMS
+        horizon: 未来收益的交易日数
+        min_conditions: 综合信号至少满足的条件个数
+        max_workers: 并行进程数, None时取CPU核数
+
+    Returns:
+        DataFrame, 每行一个参数组合: 参数、signal_count、signal_freq、mean_forward_return、hit_rate、excess_return
+    """
+    reader = BinFeatureReader(provider_uri)
+    if isinstance(instruments, str):
+        instruments = reader.list_instruments(instruments)
+    settings = [dict(zip(WINDOW_PARAMS, values))
+                for values in itertools.product(*(windows[name] for name in WINDOW_PARAMS))]
+
+    # 预热长度取所有窗口参数中最长的回看, 未来收益需要区间后 horizon 个交易日
+    lookback = max(max(s['volume_ma_period'], s['resistance_period'], s['volatility_period'] * 3) for s in settings)
+    start, end = reader.locate(start_time, end_time)
+    query_start = max(0, start - lookback)
+    query_end = min(len(reader.calendar), end + horizon)
+    matrices = {field: reader.read_matrix(instruments, field, reader.calendar[query_start],
+                                          reader.calendar[query_end - 1], dtype=np.float32)[0]
+                for field in ['close', 'high', 'volume']}
+    args = (thresholds, start - query_start, end - start, horizon, min_conditions)
+
+    print(f"参数扫描: {len(settings)} 组窗口参数 x "
+          f"{int(np.prod([len(thresholds[name]) for name in THRESHOLD_PARAMS]))} 组阈值, "
+          f"{len(instruments)} 只ETF, {end - start} 个交易日")
+    workers = min(max_workers or os.cpu_count() or 1, len(settings))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=(matrices,)) as executor:
+            futures = [executor.submit(_sweep_window_setting, setting, *args) for setting in settings]
+            results = [future.result() for future in futures]
+    else:
+        results = [_sweep_window_setting(setting, *args, matrices=matrices) for setting in settings]
+    return pd.concat(results, ignore_index=True)